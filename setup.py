@@ -34,6 +34,7 @@ setup(
     [console_scripts]
     flask-ctl = presence_analyzer.script:run
     xml = presence_analyzer.script:action_update_database
+    presence-benchmark = presence_analyzer.benchmarks:main
 
     [paste.app_factory]
     main = presence_analyzer.script:make_app
@@ -1,3 +1,16 @@
 # -*- coding: utf-8 -*-
-from .main import app
-from . import views
+"""
+Presence analyzer application package.
+"""
+
+
+def get_app():
+    """
+    Returns application with views and static assets registered. Package
+    import stays cheap, so control commands which do not serve requests
+    do not load views and templates.
+    """
+    # pylint: disable-msg=W0612
+    from presence_analyzer import assets, views
+    from presence_analyzer.main import app
+    return app
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Fingerprinted and precompressed static assets.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_file
+
+from presence_analyzer.main import app
+from presence_analyzer.storage import file_version
+from presence_analyzer.utils import cache
+
+
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def fingerprint(filename, content):
+    """
+    Inserts hash of content into file name: css/style.css becomes
+    css/style.0123abcd.css.
+    """
+    base, ext = os.path.splitext(filename)
+    return '{0}.{1}{2}'.format(base, hashlib.md5(content).hexdigest()[:8], ext)
+
+
+def build_assets(source, target):
+    """
+    Copies static files to target directory under fingerprinted names,
+    writing gzip variant of each file which compresses. Writes manifest
+    mapping original to fingerprinted names and returns it.
+    """
+    manifest = {}
+    for directory, _, names in os.walk(source):
+        for name in names:
+            path = os.path.join(directory, name)
+            filename = os.path.relpath(path, source).replace(os.sep, '/')
+            with open(path, 'rb') as asset:
+                content = asset.read()
+            hashed = fingerprint(filename, content)
+            destination = os.path.join(target, hashed)
+            if not os.path.isdir(os.path.dirname(destination)):
+                os.makedirs(os.path.dirname(destination))
+            shutil.copyfile(path, destination)
+            with gzip.open(destination + '.gz', 'wb', 9) as compressed:
+                compressed.write(content)
+            if os.path.getsize(destination + '.gz') >= len(content):
+                os.remove(destination + '.gz')
+            manifest[filename] = hashed
+
+    with open(os.path.join(target, MANIFEST + '.tmp'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.rename(
+        os.path.join(target, MANIFEST + '.tmp'),
+        os.path.join(target, MANIFEST),
+    )
+    return manifest
+
+
+def assets_version():
+    """
+    Returns token which changes whenever assets are rebuilt, None if they
+    are not configured or built.
+    """
+    if not app.config.get('ASSETS_DIR'):
+        return None
+    return file_version(os.path.join(app.config['ASSETS_DIR'], MANIFEST))
+
+
+@cache('assets_manifest', 86400)
+def load_manifest(version):
+    """
+    Returns manifest and reversed manifest of built assets. Assets version
+    is part of cache key only.
+    """
+    if version is None:
+        return {}, {}
+    with open(os.path.join(app.config['ASSETS_DIR'], MANIFEST)) as manifest:
+        names = json.load(manifest)
+    return names, {hashed: name for name, hashed in names.items()}
+
+
+@app.url_defaults
+def fingerprinted_url(endpoint, values):
+    """
+    Makes url_for('static', filename=...) point to fingerprinted asset.
+    """
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    names = load_manifest(assets_version())[0]
+    values['filename'] = names.get(values['filename'], values['filename'])
+
+
+def static_view(filename):
+    """
+    Serves fingerprinted assets with immutable cache headers, gzip variant
+    if client accepts it. Other files are served as usual.
+    """
+    if filename not in load_manifest(assets_version())[1]:
+        return app.send_static_file(filename)
+
+    path = os.path.join(app.config['ASSETS_DIR'], filename)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    gzipped = 'gzip' in request.headers.get('Accept-Encoding', '') and \
+        os.path.exists(path + '.gz')
+    response = send_file(path + '.gz' if gzipped else path, mimetype=mimetype)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.expires = None
+    return response
+
+
+app.view_functions['static'] = static_view
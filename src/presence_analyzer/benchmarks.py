@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Performance benchmarks.
+"""
+# pylint:skip-file
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import date, timedelta
+
+from presence_analyzer.main import app
+
+
+BENCHMARKS = []
+
+
+def benchmark(function):
+    """
+    Registers function in benchmark suite.
+    """
+    BENCHMARKS.append(function)
+    return function
+
+
+def timed(function, repeat=5):
+    """
+    Returns best wall time of given function in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        function()
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, seconds):
+    """
+    Prints single benchmark result.
+    """
+    print '{0:<48} {1:>10.2f} ms'.format(name, seconds * 1000)
+
+
+def generate_csv(path, users=50, days=730):
+    """
+    Writes synthetic presence CSV file, returns number of written rows.
+    """
+    rows = 0
+    first_day = date(2012, 1, 1)
+    with open(path, 'w') as csvfile:
+        for user_id in range(users):
+            for day in range(days):
+                start = random.randint(7 * 3600, 11 * 3600)
+                end = start + random.randint(4 * 3600, 9 * 3600)
+                csvfile.write('{0},{1},{2},{3}\n'.format(
+                    user_id,
+                    (first_day + timedelta(days=day)).isoformat(),
+                    format_seconds(start),
+                    format_seconds(end),
+                ))
+                rows += 1
+    return rows
+
+
+def format_seconds(value):
+    """
+    Formats seconds since midnight as HH:MM:SS.
+    """
+    return '{0:02d}:{1:02d}:{2:02d}'.format(
+        value // 3600, value % 3600 // 60, value % 60,
+    )
+
+
+@benchmark
+def benchmark_storage(workdir):
+    """
+    Compares CSV and SQLite storage backends.
+    """
+    from presence_analyzer.storage import CSVStorage, SQLiteStorage
+    from presence_analyzer import utils
+
+    config = {
+        'DATA_CSV': os.path.join(workdir, 'presence.csv'),
+        'DATA_SQLITE': os.path.join(workdir, 'presence.sqlite'),
+    }
+    rows = generate_csv(config['DATA_CSV'])
+    print 'storage: {0} rows'.format(rows)
+
+    sqlite = SQLiteStorage(config)
+    report('sqlite import_csv', timed(
+        lambda: sqlite.import_csv(config['DATA_CSV']), repeat=1,
+    ))
+    for storage in (CSVStorage(config), sqlite):
+        app.config.update(config, DATA_BACKEND=storage.name)
+        report('{0} load'.format(storage.name), timed(storage.load))
+        utils.CACHE.clear()
+        report('{0} weekday_stats (cold)'.format(storage.name), timed(
+            lambda: storage.weekday_stats(1), repeat=1,
+        ))
+        report('{0} weekday_stats (warm)'.format(storage.name), timed(
+            lambda: storage.weekday_stats(1),
+        ))
+        utils.CACHE.clear()
+
+
+@benchmark
+def benchmark_partitions(workdir):
+    """
+    Compares flat CSV with monthly partitions loaded serially, in
+    parallel and pruned to single user and month.
+    """
+    from presence_analyzer.storage import (
+        CSVStorage,
+        PartitionedStorage,
+        partition_csv,
+    )
+
+    path = os.path.join(workdir, 'partitions.csv')
+    directory = os.path.join(workdir, 'partitions')
+    os.mkdir(directory)
+    generate_csv(path)
+    partition_csv(path, directory)
+    flat = CSVStorage({'DATA_CSV': path})
+    partitioned = PartitionedStorage({'DATA_DIR': directory})
+    partitioned.manifest()
+    report('flat load', timed(flat.load, repeat=3))
+    for workers in (1, 4):
+        partitioned.workers = workers
+        report('partitioned load ({0} workers)'.format(workers), timed(
+            partitioned.load, repeat=3,
+        ))
+    report('partitioned load (1 user, 1 month)', timed(
+        lambda: partitioned.load(
+            users=[1], start=date(2013, 3, 1), end=date(2013, 3, 31),
+        ),
+    ))
+
+
+@benchmark
+def benchmark_compression(workdir):
+    """
+    Compares size and ingestion time of plain and compressed CSV files.
+    """
+    import bz2
+    import gzip
+    from presence_analyzer.storage import read_csv
+    from presence_analyzer.utils import open_data
+
+    path = os.path.join(workdir, 'compression.csv')
+    generate_csv(path)
+    with open(path, 'rb') as csvfile:
+        content = csvfile.read()
+    paths = [('plain', path)]
+    for suffix, compress in (('gz', gzip.open), ('bz2', bz2.BZ2File)):
+        compressed = '{0}.{1}'.format(path, suffix)
+        with compress(compressed, 'wb') as datafile:
+            datafile.write(content)
+        paths.append((suffix, compressed))
+
+    for name, datapath in paths:
+        print '{0}: {1} KiB'.format(name, os.path.getsize(datapath) // 1024)
+        report('{0} decode only'.format(name), timed(
+            lambda: sum(1 for _ in open_data(datapath)), repeat=3,
+        ))
+        report('{0} read_csv'.format(name), timed(
+            lambda: sum(1 for _ in read_csv(datapath)), repeat=3,
+        ))
+
+
+@benchmark
+def benchmark_first_chart(workdir):
+    """
+    Compares server time of requests needed before first chart is drawn:
+    page and raw API JSON reshaped in browser versus page with embedded
+    chart table.
+    """
+    from presence_analyzer import get_app, utils
+
+    config = {
+        'DATA_CSV': os.path.join(workdir, 'first_chart.csv'),
+        'DATA_XML': os.path.join(
+            os.path.dirname(__file__), '..', '..', 'runtime', 'data',
+            'users.xml',
+        ),
+    }
+    generate_csv(config['DATA_CSV'])
+    app.config.update(config, DATA_BACKEND='csv')
+    client = get_app().test_client()
+
+    def get(paths):
+        for path in paths:
+            resp = client.get(path)
+            if resp.status_code != 200:
+                raise AssertionError('{0} returned {1}'.format(
+                    path, resp.status_code,
+                ))
+
+    paths = {
+        'api': ['/presence_start_end', '/api/v1/presence_start_end/1'],
+        'embedded': ['/presence_start_end?user_id=1'],
+    }
+    for mode in ('api', 'embedded'):
+        for label, clear in (('cold', True), ('warm', False)):
+            if clear:
+                utils.CACHE.clear()
+            report('first chart {0} ({1}, {2} requests)'.format(
+                mode, label, len(paths[mode]),
+            ), timed(
+                lambda: get(paths[mode]),
+                repeat=1 if clear else 5,
+            ))
+    utils.CACHE.clear()
+
+
+STARTUP_ENTRY_POINTS = (
+    'presence_analyzer',
+    'presence_analyzer.script',
+    'presence_analyzer.views',
+)
+
+LAZY_MODULES = ('lxml', 'sqlite3', 'paste.script', 'werkzeug.script')
+
+
+def import_time(module):
+    """
+    Returns import time of module in fresh interpreter and list of lazily
+    loaded modules it imported anyway.
+    """
+    code = (
+        'import sys, time; started = time.time(); import {0}; '
+        'elapsed = time.time() - started; '
+        'print elapsed; print " ".join(m for m in {1!r} if m in sys.modules)'
+    ).format(module, LAZY_MODULES)
+    output = subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', code],
+    ).splitlines()
+    return float(output[0]), output[1].split() if len(output) > 1 else []
+
+
+@benchmark
+def benchmark_startup(workdir):
+    """
+    Measures import time of every entry point.
+    """
+    for module in STARTUP_ENTRY_POINTS:
+        results = [import_time(module) for _ in range(3)]
+        report('import {0}'.format(module), min(r[0] for r in results))
+        if results[0][1]:
+            print '  eagerly loaded: {0}'.format(' '.join(results[0][1]))
+
+
+def main(argv=None):
+    """
+    Runs benchmarks, optionally only these named in command line.
+    """
+    names = (argv if argv is not None else sys.argv)[1:]
+    workdir = tempfile.mkdtemp(prefix='presence_bench')
+    try:
+        for function in BENCHMARKS:
+            if names and function.__name__ not in names:
+                continue
+            function(workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Chart-ready data tables rendered on server side.
+"""
+import calendar
+from json import dumps
+
+from presence_analyzer.storage import get_storage
+from presence_analyzer.utils import cache, data_version
+
+
+def chart_time(value):
+    """
+    Converts seconds since midnight to Google Charts datetime cell with
+    HH:MM:SS formatted value.
+    """
+    milliseconds = int(round(value * 1000))
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return {
+        'v': 'Date(1, 1, 1, {0}, {1}, {2}, {3})'.format(
+            hours, minutes, seconds, milliseconds,
+        ),
+        'f': '{0:02d}:{1:02d}:{2:02d}'.format(hours, minutes, seconds),
+    }
+
+
+def presence_weekday_table(weekdays):
+    """
+    Total presence time grouped by weekday.
+    """
+    return {
+        'cols': [
+            {'type': 'string', 'label': 'Weekday'},
+            {'type': 'number', 'label': 'Presence (s)'},
+        ],
+        'rows': [
+            {'c': [{'v': calendar.day_abbr[weekday]}, {'v': stats['total']}]}
+            for weekday, stats in weekdays.items()
+        ],
+    }
+
+
+def mean_time_weekdays_table(weekdays):
+    """
+    Mean presence time grouped by weekday.
+    """
+    return {
+        'cols': [
+            {'type': 'string', 'label': 'Weekday'},
+            {'type': 'datetime', 'label': 'Mean time (h:m:s)'},
+        ],
+        'rows': [
+            {'c': [
+                {'v': calendar.day_abbr[weekday]},
+                chart_time(stats['mean']),
+            ]}
+            for weekday, stats in weekdays.items()
+        ],
+    }
+
+
+def presence_start_end_table(weekdays):
+    """
+    Mean presence start and end grouped by weekday.
+    """
+    return {
+        'cols': [
+            {'type': 'string', 'id': 'Weekday'},
+            {'type': 'datetime', 'id': 'Start'},
+            {'type': 'datetime', 'id': 'End'},
+        ],
+        'rows': [
+            {'c': [
+                {'v': calendar.day_abbr[weekday]},
+                chart_time(stats['start']),
+                chart_time(stats['end']),
+            ]}
+            for weekday, stats in weekdays.items()
+        ],
+    }
+
+
+# chart tables by name of template showing them
+CHARTS = {
+    'presence_weekday': presence_weekday_table,
+    'mean_time_weekdays': mean_time_weekdays_table,
+    'presence_start_end': presence_start_end_table,
+}
+
+
+@cache('chart_json', 600, 'users', version=data_version)
+def chart_json(name, user_id):
+    """
+    Returns serialized chart table of given user, 'null' if user has no
+    presence data. Tables are cached per user until data changes.
+    """
+    storage = get_storage()
+    if not storage.has_user(user_id):
+        return dumps(None)
+    return dumps(CHARTS[name](storage.weekday_stats(user_id)))
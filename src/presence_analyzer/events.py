@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Server-sent events with per user presence statistics deltas.
+"""
+import collections
+import errno
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import urlparse
+from json import dumps
+
+from presence_analyzer.storage import compute_weekday_stats, get_storage
+
+log = logging.getLogger(__name__)  # pylint: disable-msg=C0103
+
+PATH = '/api/v1/events'
+# seconds between keep-alive comments sent to idle subscribers
+KEEPALIVE = 15
+# number of events kept for subscribers reconnecting with Last-Event-ID
+HISTORY = 1000
+# subscriber is dropped when this many bytes are waiting for it
+MAX_BUFFER = 1024 * 1024
+# client reconnection delay in milliseconds
+RETRY = 5000
+
+# followed by CORS header of allowed origin, if any, and retry field
+HEADERS = (
+    'HTTP/1.1 200 OK\r\n'
+    'Content-Type: text/event-stream\r\n'
+    'Cache-Control: no-cache\r\n'
+    'Connection: keep-alive\r\n'
+)
+ERRORS = {
+    400: 'HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n',
+    404: 'HTTP/1.1 404 Not Found\r\nConnection: close\r\n\r\n',
+}
+
+
+def snapshot(data):
+    """
+    Returns weekday statistics of every user of presence data.
+    """
+    return {
+        user_id: compute_weekday_stats(days)
+        for user_id, days in data.items()
+    }
+
+
+def presence_deltas(old, new):
+    """
+    Compares two snapshots, returns changed weekdays statistics by user.
+    Removed users are mapped to None.
+    """
+    deltas = {}
+    for user_id, weekdays in new.items():
+        previous = old.get(user_id, {})
+        changed = {
+            weekday: stats
+            for weekday, stats in weekdays.items()
+            if previous.get(weekday) != stats
+        }
+        if changed:
+            deltas[user_id] = changed
+    for user_id in set(old) - set(new):
+        deltas[user_id] = None
+    return deltas
+
+
+class _Subscriber(object):
+    """
+    Connection of event stream client.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.request = ''
+        self.output = ''
+        self.users = None
+        self.streaming = False
+
+
+class EventServer(object):
+    """
+    Event stream server handling all subscribers in one thread with poll(),
+    so idle subscribers cost a socket and a buffer each. Subscribers may
+    filter events with user_id query string parameters, e.g.
+    /api/v1/events?user_id=10&user_id=11.
+
+    Browsers read the stream only from pages of allow_origin, e.g. the
+    application's own origin, or of the server's origin if it is None.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, allow_origin=None):
+        self.headers = HEADERS
+        if allow_origin:
+            self.headers += 'Access-Control-Allow-Origin: {0}\r\n'.format(
+                allow_origin,
+            )
+        self.headers += '\r\nretry: {0}\n\n'.format(RETRY)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(1024)
+        self.listener.setblocking(0)
+        self.address = self.listener.getsockname()
+        self.subscribers = {}
+        self.history = collections.deque(maxlen=HISTORY)
+        self.last_id = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.wake_read, self.wake_write = os.pipe()
+        self.poller = select.poll()
+        self.poller.register(self.listener.fileno(), select.POLLIN)
+        self.poller.register(self.wake_read, select.POLLIN)
+
+    def publish(self, deltas):
+        """
+        Queues event for each user of deltas, may be called from any
+        thread. Returns id of last event.
+        """
+        with self.lock:
+            for user_id, weekdays in sorted(deltas.items()):
+                self.last_id += 1
+                frame = 'id: {0}\nevent: presence\ndata: {1}\n\n'.format(
+                    self.last_id,
+                    dumps({'user_id': user_id, 'weekdays': weekdays},
+                          sort_keys=True),
+                )
+                self.pending.append((self.last_id, user_id, frame))
+            last_id = self.last_id
+        os.write(self.wake_write, '.')
+        return last_id
+
+    def stop(self):
+        """
+        Makes serve_forever return.
+        """
+        self.stopped.set()
+        os.write(self.wake_write, '.')
+
+    def serve_forever(self):
+        """
+        Accepts subscribers and delivers events until stopped.
+        """
+        keepalive = time.time() + KEEPALIVE
+        try:
+            while not self.stopped.is_set():
+                timeout = max(0, keepalive - time.time())
+                for fileno, event in self.poller.poll(timeout * 1000):
+                    if fileno == self.listener.fileno():
+                        self._accept()
+                    elif fileno == self.wake_read:
+                        os.read(self.wake_read, 4096)
+                        self._deliver()
+                    elif fileno in self.subscribers:
+                        self._handle(self.subscribers[fileno], event)
+                if time.time() >= keepalive:
+                    for subscriber in self.subscribers.values():
+                        if subscriber.streaming:
+                            self._send(subscriber, ': keepalive\n\n')
+                    keepalive = time.time() + KEEPALIVE
+        finally:
+            for subscriber in self.subscribers.values():
+                self._drop(subscriber)
+            self.listener.close()
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+
+    def _accept(self):
+        """
+        Accepts all waiting connections.
+        """
+        while True:
+            try:
+                connection = self.listener.accept()[0]
+            except socket.error as error:
+                if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            connection.setblocking(0)
+            self.subscribers[connection.fileno()] = _Subscriber(connection)
+            self.poller.register(connection.fileno(), select.POLLIN)
+
+    def _deliver(self):
+        """
+        Sends queued events to subscribers interested in them.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for event_id, user_id, frame in pending:
+            self.history.append((event_id, user_id, frame))
+            for subscriber in self.subscribers.values():
+                if subscriber.streaming and (
+                        subscriber.users is None or
+                        user_id in subscriber.users):
+                    self._send(subscriber, frame)
+
+    def _handle(self, subscriber, event):
+        """
+        Reads request of subscriber or writes its buffered output.
+        """
+        if event & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+            self._drop(subscriber)
+            return
+        if event & select.POLLIN:
+            try:
+                data = subscriber.connection.recv(4096)
+            except socket.error:
+                data = ''
+            if not data:
+                self._drop(subscriber)
+                return
+            if not subscriber.streaming:
+                subscriber.request += data
+                if '\r\n\r\n' in subscriber.request:
+                    self._subscribe(subscriber)
+                elif len(subscriber.request) > 8192:
+                    self._drop(subscriber)
+                return
+        if event & select.POLLOUT:
+            self._flush(subscriber)
+
+    def _subscribe(self, subscriber):
+        """
+        Starts event stream described by request of subscriber, replays
+        events missed since Last-Event-ID.
+        """
+        lines = subscriber.request.split('\r\n')
+        try:
+            method, target = lines[0].split()[:2]
+            headers = dict(
+                [part.strip() for part in line.split(':', 1)]
+                for line in lines[1:] if ':' in line
+            )
+            url = urlparse.urlsplit(target)
+            users = [
+                int(value) for value in
+                urlparse.parse_qs(url.query).get('user_id', [])
+            ]
+            last_id = int(headers.get('Last-Event-ID', 0))
+        except ValueError:
+            self._reject(subscriber, 400)
+            return
+        if method != 'GET' or url.path != PATH:
+            self._reject(subscriber, 404)
+            return
+
+        subscriber.users = set(users) if users else None
+        subscriber.streaming = True
+        self._send(subscriber, self.headers + ''.join(
+            frame for event_id, user_id, frame in self.history
+            if event_id > last_id and
+            (subscriber.users is None or user_id in subscriber.users)
+        ))
+
+    def _reject(self, subscriber, status):
+        """
+        Answers subscriber with error status and drops it.
+        """
+        try:
+            subscriber.connection.send(ERRORS[status])
+        except socket.error:
+            pass
+        self._drop(subscriber)
+
+    def _send(self, subscriber, data):
+        """
+        Buffers data for subscriber and writes as much as possible.
+        """
+        subscriber.output += data
+        if len(subscriber.output) > MAX_BUFFER:
+            log.warning('Dropping slow subscriber %s',
+                        subscriber.connection.fileno())
+            self._drop(subscriber)
+            return
+        self._flush(subscriber)
+
+    def _flush(self, subscriber):
+        """
+        Writes buffered output of subscriber, waits for socket to become
+        writable if it is not written entirely.
+        """
+        try:
+            sent = subscriber.connection.send(subscriber.output)
+        except socket.error as error:
+            if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._drop(subscriber)
+                return
+            sent = 0
+        subscriber.output = subscriber.output[sent:]
+        self.poller.modify(
+            subscriber.connection.fileno(),
+            select.POLLIN | select.POLLOUT if subscriber.output
+            else select.POLLIN,
+        )
+
+    def _drop(self, subscriber):
+        """
+        Closes connection of subscriber.
+        """
+        fileno = subscriber.connection.fileno()
+        if self.subscribers.pop(fileno, None) is not None:
+            self.poller.unregister(fileno)
+        subscriber.connection.close()
+
+
+def watch(server, interval=5.0):
+    """
+    Checks presence data version every interval seconds, when new rows are
+    loaded publishes changed weekday statistics of users to server.
+    """
+    version, stats = None, None
+    while not server.stopped.is_set():
+        try:
+            storage = get_storage()
+            current = storage.data_version()
+            if current != version:
+                new_stats = snapshot(storage.load())
+                if stats is not None:
+                    deltas = presence_deltas(stats, new_stats)
+                    if deltas:
+                        server.publish(deltas)
+                        log.info('Published deltas of %d users', len(deltas))
+                version, stats = current, new_stats
+        except Exception:  # pylint: disable-msg=W0703
+            log.exception('Checking presence data failed')
+        server.stopped.wait(interval)
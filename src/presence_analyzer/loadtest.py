@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+In-process load generator and latency report.
+"""
+import itertools
+import math
+import random
+import select
+import socket
+import threading
+import time
+
+from presence_analyzer.main import app
+
+
+# (path, weight), {user_id} is replaced with random user having data
+DEFAULT_MIX = (
+    ('/api/v1/users', 1),
+    ('/api/v2/users', 1),
+    ('/api/v3/users', 1),
+    ('/api/v1/mean_time_weekday/{user_id}', 3),
+    ('/api/v1/presence_weekday/{user_id}', 3),
+    ('/api/v1/presence_start_end/{user_id}', 3),
+    ('/presence_weekday', 1),
+)
+
+
+def parse_mix(value):
+    """
+    Parses request mix given as 'path:weight,path:weight'.
+    """
+    mix = []
+    for item in value.split(','):
+        path, _, weight = item.strip().rpartition(':')
+        if not path:
+            path, weight = weight, '1'
+        mix.append((path, int(weight)))
+    return tuple(mix)
+
+
+def percentile(values, percent):
+    """
+    Returns percentile of sorted values using nearest-rank method.
+    """
+    if not values:
+        return 0
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+def in_process_client():
+    """
+    Returns function requesting path from WSGI application in-process.
+    """
+    client = app.test_client()
+
+    def get(path):
+        response = client.get(path)
+        response.close()
+        return response.status_code
+    return get
+
+
+def http_client(base_url):
+    """
+    Returns function requesting path from locally started server.
+    """
+    import urllib2
+
+    def get(path):
+        try:
+            response = urllib2.urlopen(base_url.rstrip('/') + path)
+            response.read()
+            return response.getcode()
+        except urllib2.HTTPError as error:
+            return error.code
+    return get
+
+
+def run(requests=1000, concurrency=10, mix=DEFAULT_MIX, base_url=None,
+        users=None):
+    """
+    Sends requests drawn from weighted mix by concurrency threads and
+    returns report with throughput and latency percentiles in seconds.
+    """
+    if users is None:
+        from presence_analyzer.utils import get_data
+        users = sorted(get_data()) or [0]
+    paths = [path for path, weight in mix for _ in range(weight)]
+    counter = itertools.count()
+    results = []
+
+    def worker():
+        get = http_client(base_url) if base_url else in_process_client()
+        while next(counter) < requests:
+            path = random.choice(paths)
+            path = path.format(user_id=random.choice(users))
+            started = time.time()
+            status = get(path)
+            results.append((path, status, time.time() - started))
+
+    started = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return make_report(results, time.time() - started)
+
+
+def make_report(results, elapsed):
+    """
+    Summarizes (path, status, latency) results.
+    """
+    latencies = sorted(latency for _, _, latency in results)
+    statuses = {}
+    for _, status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'requests': len(results),
+        'elapsed': elapsed,
+        'throughput': len(results) / elapsed if elapsed else 0,
+        'statuses': statuses,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else 0,
+    }
+
+
+def format_report(report):
+    """
+    Formats report for printing.
+    """
+    return '\n'.join([
+        'requests:   {requests} in {elapsed:.2f}s',
+        'throughput: {throughput:.1f} req/s',
+        'latency:    p50 {p50_ms:.1f} ms, p95 {p95_ms:.1f} ms, '
+        'p99 {p99_ms:.1f} ms, max {max_ms:.1f} ms',
+        'statuses:   {statuses_text}',
+    ]).format(
+        statuses_text=', '.join(
+            '{0}: {1}'.format(status, count)
+            for status, count in sorted(report['statuses'].items())
+        ),
+        p50_ms=report['p50'] * 1000,
+        p95_ms=report['p95'] * 1000,
+        p99_ms=report['p99'] * 1000,
+        max_ms=report['max'] * 1000,
+        **report
+    )
+
+
+def subscribe(address, count=100, events=1, timeout=10.0,
+              path='/api/v1/events', on_ready=None):
+    """
+    Opens count event stream subscriptions to (host, port) address, all
+    handled by one thread, and reads until each subscriber received events
+    events or timeout passed. on_ready is called once all subscribers are
+    streaming, delivery latency is measured from that moment.
+    """
+    poller = select.poll()
+    clients = {}
+    for _ in range(count):
+        connection = socket.create_connection(address, timeout)
+        connection.sendall(
+            'GET {0} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path),
+        )
+        connection.setblocking(0)
+        clients[connection.fileno()] = {'connection': connection, 'data': ''}
+        poller.register(connection.fileno(), select.POLLIN)
+
+    waiting = set(clients)
+    streaming = set()
+    latencies = []
+    ready_at = None
+    deadline = time.time() + timeout
+    try:
+        while waiting and time.time() < deadline:
+            if ready_at is None and len(streaming) == count:
+                ready_at = time.time()
+                if on_ready is not None:
+                    on_ready()
+            for fileno, _ in poller.poll(100):
+                client = clients[fileno]
+                data = client['connection'].recv(65536)
+                client['data'] += data
+                if '\r\n\r\n' in client['data']:
+                    streaming.add(fileno)
+                if not data or \
+                        client['data'].count('\nevent: ') >= events:
+                    if data and ready_at is not None:
+                        latencies.append(time.time() - ready_at)
+                    poller.unregister(fileno)
+                    waiting.discard(fileno)
+    finally:
+        for client in clients.values():
+            client['connection'].close()
+    latencies.sort()
+    return {
+        'subscribers': count,
+        'streaming': len(streaming),
+        'completed': len(latencies),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else 0,
+    }
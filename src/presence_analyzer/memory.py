@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Memory accounting of cached structures and memory budget.
+"""
+import logging
+import os
+
+from presence_analyzer import utils
+from presence_analyzer.main import app
+
+log = logging.getLogger(__name__)  # pylint: disable-msg=C0103
+
+# kinds of cache entries in eviction order: serialized responses, per
+# user entries built on first request of user, indexes, parsed data
+KINDS = ('responses', 'users', 'indexes', 'store')
+# evicted entries by kind
+EVICTED = {kind: 0 for kind in KINDS}
+CONTAINERS = (dict, list, tuple, set, frozenset)
+
+
+def sizeof(value):
+    """
+    Returns approximate number of bytes used by value and all objects it
+    contains, objects referenced more than once are counted once.
+    """
+    import sys
+    seen = set()
+    stack = [value]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, CONTAINERS):
+            stack.extend(item)
+    return size
+
+
+def entry_size(entry):
+    """
+    Returns size of cache entry value, computed once per entry.
+    """
+    if 'size' not in entry:
+        entry['size'] = sizeof(entry['value'])
+    return entry['size']
+
+
+def rss():
+    """
+    Returns resident set size of process in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        # peak instead of current size, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def usage():
+    """
+    Returns number of entries and bytes of cached structures by cache key
+    and by kind, with budget and resident set size of process.
+    """
+    structures = {}
+    kinds = {kind: {'entries': 0, 'bytes': 0} for kind in KINDS}
+    for item_key, entry in utils.CACHE.items():
+        name = item_key[0] if isinstance(item_key, tuple) else item_key
+        structure = structures.setdefault(name, {
+            'kind': entry['kind'], 'entries': 0, 'bytes': 0,
+        })
+        size = entry_size(entry)
+        for stats in (structure, kinds[entry['kind']]):
+            stats['entries'] += 1
+            stats['bytes'] += size
+    return {
+        'budget': app.config.get('MEMORY_BUDGET') or None,
+        'total': sum(stats['bytes'] for stats in kinds.values()),
+        'rss': rss(),
+        'kinds': kinds,
+        'structures': structures,
+        'evicted': EVICTED,
+    }
+
+
+def enforce_budget(keep=None):
+    """
+    Evicts cache entries until their total size fits MEMORY_BUDGET bytes.
+    Responses go first, then per user entries, indexes and parsed data,
+    least recently used first within kind. Entry of keep key is never
+    evicted. Returns total size of remaining entries.
+    """
+    budget = app.config.get('MEMORY_BUDGET')
+    entries = utils.CACHE.items()
+    total = sum(entry_size(entry) for _, entry in entries)
+    if not budget or total <= budget:
+        return total
+
+    entries.sort(key=lambda item: (KINDS.index(item[1]['kind']),
+                                   item[1]['used']))
+    for item_key, entry in entries:
+        if total <= budget:
+            break
+        if item_key == keep:
+            continue
+        if utils.CACHE.pop(item_key, None) is not None:
+            total -= entry['size']
+            EVICTED[entry['kind']] += 1
+    if total > budget:
+        log.warning('Cache uses %d bytes over budget of %d bytes',
+                    total - budget, budget)
+    return total
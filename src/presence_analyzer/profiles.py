@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Join of presence data users and users.xml profiles.
+"""
+import locale
+import logging
+from json import dumps
+
+from presence_analyzer.utils import (
+    cache,
+    get_data,
+    get_xml_data,
+    sources_version,
+)
+
+log = logging.getLogger(__name__)  # pylint: disable-msg=C0103
+
+# Polish alphabet, order of names when pl_PL locale is not installed
+ALPHABET = u'aąbcćdeęfghijklłmnńoópqrsśtuvwxyzźż'
+
+
+def _alphabet_key(name):
+    """
+    Returns key ordering name by Polish alphabet, other characters such
+    as spaces and dots go first.
+    """
+    if not isinstance(name, unicode):
+        name = name.decode('utf-8')
+    return [(ALPHABET.find(char) + 1, char) for char in name.lower()]
+
+
+def collation_key():
+    """
+    Returns function giving collation key of name in pl_PL locale, the
+    order of /api/v2/users, or in Polish alphabet if locale is missing.
+    """
+    try:
+        locale.setlocale(locale.LC_COLLATE, 'pl_PL.UTF-8')
+    except locale.Error:
+        log.warning('Locale pl_PL.UTF-8 missing, sorting by alphabet')
+        return _alphabet_key
+    return lambda name: locale.strxfrm(
+        name.encode('utf-8') if isinstance(name, unicode) else name
+    )
+
+
+@cache('user_index', 600, version=sources_version)
+def user_index():
+    """
+    Returns profile and presence data span of every user known from either
+    source, keyed by user id. Index is rebuilt when any source changes.
+    """
+    profiles = get_xml_data()
+    data = get_data()
+    index = {}
+    for user_id in set(profiles) | set(data):
+        profile = profiles.get(user_id)
+        dates = data.get(user_id)
+        index[user_id] = {
+            'user_id': user_id,
+            'name': profile['name'] if profile else 'User {0}'.format(user_id),
+            'image': profile['image'] if profile else None,
+            'has_profile': profile is not None,
+            'has_data': bool(dates),
+            'first_date': min(dates).isoformat() if dates else None,
+            'last_date': max(dates).isoformat() if dates else None,
+            'days': len(dates) if dates else 0,
+        }
+    return index
+
+
+@cache('users_json', 600, 'responses', version=sources_version)
+def users_json():
+    """
+    Returns serialized list of indexed users sorted by name in Polish
+    collation.
+    """
+    name_key = collation_key()
+    return dumps(sorted(
+        user_index().values(),
+        key=lambda user: (name_key(user['name']), user['user_id']),
+    ))
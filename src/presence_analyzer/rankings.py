@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-user rankings over precomputed per-user aggregates.
+"""
+import bisect
+import heapq
+
+from presence_analyzer.storage import get_storage
+from presence_analyzer.utils import cache, data_version
+
+
+def _mean(total, count):
+    """
+    Returns total divided by count, None for no entries.
+    """
+    return float(total) / count if count else None
+
+
+# ranking metric: function of summed aggregate returning value or None
+METRICS = {
+    'start': lambda agg: _mean(agg['start'], agg['count']),
+    'end': lambda agg: _mean(agg['end'], agg['count']),
+    'mean': lambda agg: _mean(agg['presence'], agg['count']),
+    'total': lambda agg: agg['presence'] if agg['count'] else None,
+}
+FIELDS = ('start', 'end', 'presence')
+
+
+def _empty():
+    """
+    Returns empty aggregate.
+    """
+    return {'count': 0, 'start': 0, 'end': 0, 'presence': 0}
+
+
+@cache('ranking_index', 600, version=data_version)
+def ranking_index():
+    """
+    Returns per user and weekday ordinals of presence days in date order
+    with prefix sums of first arrivals, last departures and presence time,
+    so sums over any date range take two bisections. Index is built once
+    per data version.
+    """
+    days = {}
+    for user_id, date, start, end, presence in get_storage().day_summaries():
+        days.setdefault(user_id, [[] for _ in range(7)])[
+            date.weekday()
+        ].append((date.toordinal(), start, end, presence))
+
+    index = {}
+    for user_id, weekdays in days.items():
+        index[user_id] = []
+        for entries in weekdays:
+            entries.sort()
+            ordinals = [entry[0] for entry in entries]
+            sums = {field: [0] for field in FIELDS}
+            for entry in entries:
+                for position, field in enumerate(FIELDS, 1):
+                    sums[field].append(sums[field][-1] + entry[position])
+            index[user_id].append((ordinals, sums))
+    return index
+
+
+def user_aggregate(weekdays_index, weekdays, start=None, end=None):
+    """
+    Sums aggregates of given weekdays between start and end dates from
+    user's part of ranking index.
+    """
+    agg = _empty()
+    for weekday in weekdays:
+        ordinals, sums = weekdays_index[weekday]
+        low = 0 if start is None else \
+            bisect.bisect_left(ordinals, start.toordinal())
+        high = len(ordinals) if end is None else \
+            bisect.bisect_right(ordinals, end.toordinal())
+        if high <= low:
+            continue
+        agg['count'] += high - low
+        for field in FIELDS:
+            agg[field] += sums[field][high] - sums[field][low]
+    return agg
+
+
+def rank(metric, limit=10, largest=False, weekdays=None, start=None,
+         end=None):
+    """
+    Returns limit of (user_id, value) pairs with smallest, or largest,
+    value of metric. Users without entries matching filters are skipped.
+    """
+    weekdays = range(7) if weekdays is None else weekdays
+    values = []
+    for user_id, weekdays_index in ranking_index().items():
+        value = METRICS[metric](
+            user_aggregate(weekdays_index, weekdays, start, end),
+        )
+        if value is not None:
+            values.append((user_id, value))
+    select = heapq.nlargest if largest else heapq.nsmallest
+    return select(limit, values, key=lambda item: (item[1], -item[0])
+                  if largest else (item[1], item[0]))
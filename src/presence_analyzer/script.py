@@ -4,12 +4,9 @@
 
 import os
 import sys
+import threading
+import time
 from functools import partial
-from presence_analyzer import app
-
-import paste.script.command
-import werkzeug.script
-import presence_analyzer
 
 etc = partial(os.path.join, 'parts', 'etc')
 
@@ -27,13 +24,35 @@ abspath = partial(os.path.join, _buildout_path)
 del _buildout_path
 
 
-# bin/paster serve parts/etc/deploy.ini
-def make_app(global_conf={}, config=DEPLOY_CFG, debug=False):
+def _load_config(config=DEPLOY_CFG, debug=False):
+    """Load configuration file into the application."""
+    from presence_analyzer import get_app
+    app = get_app()
     app.config.from_pyfile(abspath(config))
     app.debug = debug
     return app
 
 
+# bin/paster serve parts/etc/deploy.ini
+def make_app(global_conf={}, config=DEPLOY_CFG, debug=False):
+    app = _load_config(config, debug)
+    if app.config.get('WARM_UP'):
+        _warm_up(background=app.config.get('WARM_UP_BACKGROUND', False))
+    return app
+
+
+def _warm_up(background=False):
+    """Warm caches up, optionally in a thread while /health reports 503."""
+    from presence_analyzer.utils import STATUS, warm_up
+    if not background:
+        warm_up()
+        return
+    STATUS['ready'] = False
+    thread = threading.Thread(target=warm_up, name='warm-up')
+    thread.daemon = True
+    thread.start()
+
+
 # bin/paster serve parts/etc/debug.ini
 def make_debug(global_conf={}, **conf):
     from werkzeug.debug import DebuggedApplication
@@ -45,22 +64,178 @@ def make_debug(global_conf={}, **conf):
 def make_shell():
     """Interactive Flask Shell"""
     from flask import request
-    app = make_app()
+    app = _load_config()
     http = app.test_client()
     reqctx = app.test_request_context
     return locals()
 
 
+def _configure(debug=False):
+    """Load debug or deployment configuration into the application.
+
+    Caches are not warmed up, offline commands do not serve requests.
+    """
+    return _load_config(DEBUG_CFG if debug else DEPLOY_CFG, debug)
+
+
 # bin/flask-ctl xml
 def action_update_database(debug=True):
-    app = presence_analyzer.app
-    if debug:
-        config = DEBUG_CFG
+    from presence_analyzer.utils import update_user_xml
+    _configure(debug)
+    update_user_xml()
+
+
+def _progress(rows, every=100000):
+    """Pass rows through, printing throughput every 'every' rows."""
+    started = time.time()
+    for count, row in enumerate(rows, 1):
+        if count % every == 0:
+            print >> sys.stderr, '{0} rows ({1:.0f} rows/s)'.format(
+                count, count / max(time.time() - started, 1e-6),
+            )
+        yield row
+
+
+def _report(action, stats, started):
+    """Print summary of bulk import or export."""
+    elapsed = max(time.time() - started, 1e-6)
+    print '{0}: {1} rows in {2:.2f}s ({3:.0f} rows/s), {4} rejected, ' \
+        '{5} skipped'.format(
+            action, stats.get('rows', 0), elapsed,
+            stats.get('rows', 0) / elapsed, stats.get('rejected', 0),
+            stats.get('skipped', 0),
+        )
+
+
+# bin/flask-ctl import_presence
+def import_presence(source=None, debug=False, dry_run=False):
+    """Stream presence CSV into SQLite database with prebuilt aggregates."""
+    from presence_analyzer.storage import SQLiteStorage, read_csv
+    app = _configure(debug)
+    source = source or app.config['DATA_CSV']
+    stats = {}
+    started = time.time()
+    if dry_run:
+        for _ in _progress(read_csv(source, stats)):
+            pass
     else:
-        config = DEPLOY_CFG
-    app.config.from_pyfile(abspath(config))
-    app.debug = debug
-    presence_analyzer.utils.update_user_xml()
+        SQLiteStorage(app.config).import_csv(
+            source, stats=stats, progress=_progress,
+        )
+    _report('validate' if dry_run else 'import', stats, started)
+    return stats
+
+
+# bin/flask-ctl export_presence
+def export_presence(target, debug=False):
+    """Stream presence entries from configured storage into CSV file."""
+    from presence_analyzer.storage import get_storage, write_csv
+    _configure(debug)
+    started = time.time()
+    count = write_csv(target, _progress(get_storage().rows()))
+    _report('export', {'rows': count}, started)
+    return count
+
+
+# bin/flask-ctl partition_presence --target=DIR
+def partition_presence(target, source=None, debug=False):
+    """Split presence CSV into directory of monthly partitions."""
+    from presence_analyzer.storage import PartitionedStorage, partition_csv
+    app = _configure(debug)
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    started = time.time()
+    count = partition_csv(source or app.config['DATA_CSV'], target)
+    PartitionedStorage({'DATA_DIR': target}).manifest()
+    _report('partition', {'rows': count}, started)
+    return count
+
+
+# bin/flask-ctl build_assets
+def build_assets(debug=False):
+    """Write fingerprinted and gzipped static assets to ASSETS_DIR."""
+    from presence_analyzer.assets import build_assets
+    app = _configure(debug)
+    if not app.config.get('ASSETS_DIR'):
+        print >> sys.stderr, 'ASSETS_DIR is not configured, static ' \
+            'assets are served unprocessed.'
+        sys.exit(1)
+    manifest = build_assets(app.static_folder, app.config['ASSETS_DIR'])
+    for name, hashed in sorted(manifest.items()):
+        print '{0} -> {1}'.format(name, hashed)
+    return manifest
+
+
+# bin/flask-ctl loadtest
+def loadtest(requests=1000, concurrency=10, url=None, mix=None,
+             debug=False):
+    """Drive the application with request mix and print latency report."""
+    from presence_analyzer import loadtest
+    _configure(debug)
+    report = loadtest.run(
+        requests=requests,
+        concurrency=concurrency,
+        mix=loadtest.parse_mix(mix) if mix else loadtest.DEFAULT_MIX,
+        base_url=url,
+    )
+    print loadtest.format_report(report)
+    return report
+
+
+# bin/flask-ctl events
+def serve_events(debug=False):
+    """Serve presence deltas as server-sent events until interrupted."""
+    from presence_analyzer.events import EventServer, watch
+    app = _configure(debug)
+    server = EventServer(
+        app.config.get('EVENTS_HOST', '127.0.0.1'),
+        app.config.get('EVENTS_PORT', 5001),
+        app.config.get('EVENTS_ALLOW_ORIGIN'),
+    )
+    thread = threading.Thread(
+        target=watch,
+        args=(server, app.config.get('EVENTS_INTERVAL', 5.0)),
+        name='events-watch',
+    )
+    thread.daemon = True
+    thread.start()
+    print 'Serving events on http://{0}:{1}/api/v1/events'.format(
+        *server.address
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+# bin/flask-ctl events_loadtest
+def events_loadtest(subscribers=500, events=1, timeout=30.0):
+    """Deliver events to many subscribers of in-process event server."""
+    from presence_analyzer import loadtest
+    from presence_analyzer.events import EventServer
+    server = EventServer()
+    thread = threading.Thread(target=server.serve_forever, name='events')
+    thread.daemon = True
+    thread.start()
+
+    def publish():
+        for user_id in range(events):
+            server.publish({user_id: {0: {'total': 0, 'mean': 0,
+                                          'start': 0, 'end': 0}}})
+    try:
+        report = loadtest.subscribe(
+            server.address, subscribers, events, timeout, on_ready=publish,
+        )
+    finally:
+        server.stop()
+        thread.join()
+    print 'subscribers: {subscribers}, streaming {streaming}, ' \
+        'completed {completed}'.format(**report)
+    print 'delivery:    p50 {0:.1f} ms, p95 {1:.1f} ms, p99 {2:.1f} ms, ' \
+        'max {3:.1f} ms'.format(*[
+            report[name] * 1000 for name in ('p50', 'p95', 'p99', 'max')
+        ])
+    return report
 
 
 def _serve(action, debug=False, dry_run=False):
@@ -88,11 +263,13 @@ def _serve(action, debug=False, dry_run=False):
         ]
     sys.argv = argv[:2] + [abspath(config)] + argv[3:]
     # Run the 'paster' command
+    import paste.script.command
     paste.script.command.run()
 
 
 # bin/flask-ctl ...
 def run():
+    import werkzeug.script
     action_shell = werkzeug.script.make_shell(make_shell, make_shell.__doc__)
     # bin/flask-ctl serve [fg|start|stop|restart|status]
 
@@ -123,4 +300,85 @@ def run():
         """Stop the application."""
         _serve('stop', dry_run=dry_run)
 
+    # bin/flask-ctl import_presence [--source=FILE] [--dry-run]
+    def action_import_presence(source='', debug=False, dry_run=False):
+        """Import presence CSV into SQLite storage.
+
+        Rows are streamed, so files of any size are imported in bounded
+        memory. Indexes and weekday aggregates are built ahead of time.
+
+        Options:
+         - '--source' CSV file, defaults to DATA_CSV
+         - '--dry-run' only validate the file and count rejected rows
+        """
+        import_presence(source or None, debug=debug, dry_run=dry_run)
+
+    # bin/flask-ctl export_presence --target=FILE
+    def action_export_presence(target=('t', ''), debug=False):
+        """Export presence entries from configured storage to CSV."""
+        if not target:
+            print >> sys.stderr, 'Missing --target option.'
+            sys.exit(1)
+        export_presence(target, debug=debug)
+
+    # bin/flask-ctl partition_presence --target=DIR [--source=FILE]
+    def action_partition_presence(target=('t', ''), source='', debug=False):
+        """Split presence CSV into directory of monthly partitions.
+
+        Rows are appended to existing partitions, a manifest of user
+        sets and date bounds is written along.
+        """
+        if not target:
+            print >> sys.stderr, 'Missing --target option.'
+            sys.exit(1)
+        partition_presence(target, source or None, debug=debug)
+
+    # bin/flask-ctl build_assets
+    def action_build_assets(debug=False):
+        """Fingerprint and precompress static assets.
+
+        Pages then link to hashed file names served with immutable
+        cache headers, run it on every deployment.
+        """
+        build_assets(debug=debug)
+
+    # bin/flask-ctl loadtest [-n 1000] [-c 10] [--url=URL] [--mix=MIX]
+    def action_loadtest(requests=('n', 1000), concurrency=('c', 10),
+                        url=('u', ''), mix=('m', ''), debug=False):
+        """Load test the application.
+
+        Requests are sent in-process to the WSGI application, or to a
+        running server if --url is given (e.g. http://localhost:1246).
+
+        Options:
+         - '-n' total number of requests
+         - '-c' number of concurrent clients
+         - '--mix' weighted paths, e.g. '/api/v1/users:1,/presence_weekday:3',
+           {user_id} in path is replaced with random user
+        """
+        loadtest(requests, concurrency, url or None, mix or None, debug)
+
+    # bin/flask-ctl events
+    def action_events(debug=False):
+        """Serve server-sent events with presence deltas.
+
+        Presence data is checked every EVENTS_INTERVAL seconds, changed
+        weekday statistics are pushed to subscribers of
+        http://EVENTS_HOST:EVENTS_PORT/api/v1/events[?user_id=ID].
+        Pages of EVENTS_ALLOW_ORIGIN only, e.g. the application's own
+        origin, may read the stream in browser.
+        """
+        serve_events(debug=debug)
+
+    # bin/flask-ctl events_loadtest [-n 500] [-e 1]
+    def action_events_loadtest(subscribers=('n', 500), events=('e', 1),
+                               timeout=('t', 30.0)):
+        """Load test event delivery to many idle subscribers.
+
+        Options:
+         - '-n' number of concurrent subscribers
+         - '-e' number of events published to all of them
+        """
+        events_loadtest(subscribers, events, timeout)
+
     werkzeug.script.run()
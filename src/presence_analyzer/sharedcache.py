@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache shared by application processes on one host.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from json import dumps
+
+from presence_analyzer.main import app
+from presence_analyzer.utils import sources_version
+
+log = logging.getLogger(__name__)  # pylint: disable-msg=C0103
+
+# hits and misses of shared cache in this process
+STATS = {'hits': 0, 'misses': 0}
+# time of last sweep by cache directory
+SWEPT = {}
+
+
+class SharedCache(object):
+    """
+    Serialized values stored as files in directory shared by processes,
+    e.g. on /dev/shm to keep them in shared memory. Files are replaced
+    atomically and entry is computed by one process at a time, others
+    wait on its lock file and read the result.
+
+    Entries of each data version are kept in own subdirectory. Writers
+    sweep directories of other versions and expired entries at most once
+    per sweep interval.
+    """
+    # seconds between sweeps, also age of other version directories which
+    # are removed, processes may still use them until they notice change
+    sweep_interval = 60
+
+    def __init__(self, root, version):
+        self.root = root
+        self.directory = os.path.join(
+            root, hashlib.md5(dumps(version)).hexdigest(),
+        )
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # created by another process meanwhile
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def path(self, key):
+        """
+        Returns path of entry file.
+        """
+        return os.path.join(self.directory, hashlib.md5(key).hexdigest())
+
+    def get(self, key, duration):
+        """
+        Returns value stored not earlier than duration seconds ago, None if
+        there is no such value.
+        """
+        path = self.path(key)
+        try:
+            if time.time() - os.path.getmtime(path) >= duration:
+                return None
+            with open(path, 'rb') as entry:
+                return entry.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, value, duration):
+        """
+        Stores value, sweeping old files if it is time to.
+        """
+        path = self.path(key)
+        temporary = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            with open(temporary, 'wb') as entry:
+                entry.write(value)
+            os.rename(temporary, path)
+        except (IOError, OSError):
+            # version directory swept by another process after change
+            log.warning('Cannot store shared cache entry', exc_info=True)
+            return
+        if time.time() - SWEPT.get(self.root, 0) >= self.sweep_interval:
+            SWEPT[self.root] = time.time()
+            self.sweep(duration)
+
+    def sweep(self, duration):
+        """
+        Removes directories of other versions not modified for sweep
+        interval, and entries older than duration. Lock files of current
+        version are kept, another process may hold them while computing.
+        """
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path == self.directory or not os.path.isdir(path):
+                continue
+            try:
+                if now - os.path.getmtime(path) >= self.sweep_interval:
+                    shutil.rmtree(path)
+            except OSError:
+                # removed by another process meanwhile
+                pass
+        for name in os.listdir(self.directory):
+            if name.endswith('.lock'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) >= duration:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Holds exclusive lock of entry across processes.
+        """
+        import fcntl
+        try:
+            lock_file = open(self.path(key) + '.lock', 'a')
+        except IOError:
+            # version directory swept by another process after change
+            log.warning('Cannot lock shared cache entry', exc_info=True)
+            yield
+            return
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_or_compute(self, key, duration, compute):
+        """
+        Returns stored value or stores value computed by compute function.
+        Only one process computes value, others wait for it.
+        """
+        value = self.get(key, duration)
+        if value is None:
+            with self.lock(key):
+                value = self.get(key, duration)
+                if value is None:
+                    STATS['misses'] += 1
+                    value = compute()
+                    self.set(key, value, duration)
+                    return value
+        STATS['hits'] += 1
+        return value
+
+
+def shared(key, duration, compute, args=(), kwargs=None):
+    """
+    Returns serialized value computed by compute function, through shared
+    cache if SHARED_CACHE_DIR is configured. Entries are keyed by key,
+    arguments and version of presence and XML data.
+    """
+    root = app.config.get('SHARED_CACHE_DIR')
+    if not root:
+        return compute()
+    entry_key = dumps([key, args, sorted((kwargs or {}).items())])
+    cache = SharedCache(root, sources_version())
+    return cache.get_or_compute(entry_key, duration, compute)
@@ -0,0 +1,68 @@
+function presenceChart(settings) {
+    var loading = $('#loading'),
+        chart_div = $('#chart_div'),
+        avatar = $('#image'),
+        users = {};
+
+    function markFirstChart() {
+        if (window.timeToFirstChart === undefined && window.performance) {
+            window.timeToFirstChart = window.performance.now();
+            if (window.console) {
+                console.log('Time to first chart: ' + Math.round(window.timeToFirstChart) + ' ms');
+            }
+        }
+    }
+
+    function draw(user, table) {
+        if (user) {
+            avatar.attr('src', user.image);
+        }
+        if (table) {
+            chart_div.show();
+            var chart = new google.visualization[settings.chartType](chart_div[0]);
+            chart.draw(new google.visualization.DataTable(table), settings.options || {});
+        } else {
+            chart_div.text('Sory, no data for ' + (user ? user.name : ''));
+            chart_div.show();
+        }
+        markFirstChart();
+        loading.hide();
+        avatar.show();
+    }
+
+    $(document).ready(function() {
+        var dropdown = $('#user_id');
+        $.getJSON(settings.usersUrl, function(result) {
+            $.each(result, function(item) {
+                if (!this.has_data) {
+                    return;
+                }
+                users[this.user_id] = {name: this.name, image: this.image};
+                dropdown.append($("<option />").val(this.user_id).text(this.name));
+            });
+            if (settings.initial) {
+                dropdown.val(settings.initial.user_id);
+            }
+            dropdown.show();
+            if (!settings.initial) {
+                loading.hide();
+            }
+        });
+        dropdown.change(function() {
+            var selected_user = dropdown.val();
+            if (selected_user) {
+                chart_div.hide();
+                avatar.hide();
+                loading.show();
+                $.getJSON(settings.chartUrl + selected_user, function(table) {
+                    draw(users[selected_user], table);
+                });
+            }
+        });
+        if (settings.initial) {
+            google.setOnLoadCallback(function() {
+                draw(settings.initial.user, settings.initial.table);
+            });
+        }
+    });
+}
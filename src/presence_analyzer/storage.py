@@ -0,0 +1,727 @@
+# -*- coding: utf-8 -*-
+"""
+Presence data storage backends.
+"""
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from datetime import date as date_cls, datetime, time as time_cls
+
+from presence_analyzer.main import app
+from presence_analyzer.utils import (
+    add_interval,
+    count_avg_group_by_weekday,
+    get_data,
+    group_by_weekday,
+    mean,
+    merge_interval,
+    open_data,
+    presence_time,
+    seconds_since_midnight,
+)
+
+
+log = logging.getLogger(__name__)  # pylint: disable-msg=C0103
+
+
+def read_csv(path, stats=None):
+    """
+    Yields (user_id, date, start, end) tuples parsed from presence CSV file,
+    which may be compressed. Malformed lines are logged and skipped.
+
+    If stats dict is given, counts of 'rows', 'skipped' (header and footer)
+    and 'rejected' (malformed) lines are accumulated in it.
+    """
+    if stats is None:
+        stats = {}
+    for key in ('rows', 'skipped', 'rejected'):
+        stats.setdefault(key, 0)
+
+    with open_data(path) as csvfile:
+        presence_reader = csv.reader(csvfile, delimiter=',')
+        for i, row in enumerate(presence_reader):
+            if len(row) != 4:
+                # ignore header and footer lines
+                stats['skipped'] += 1
+                continue
+
+            try:
+                user_id = int(row[0])
+                date = datetime.strptime(row[1], '%Y-%m-%d').date()
+                start = datetime.strptime(row[2], '%H:%M:%S').time()
+                end = datetime.strptime(row[3], '%H:%M:%S').time()
+            except (ValueError, TypeError):
+                log.debug('Problem with line %d: ', i, exc_info=True)
+                stats['rejected'] += 1
+                continue
+
+            stats['rows'] += 1
+            yield user_id, date, start, end
+
+
+def write_csv(path, rows):
+    """
+    Writes (user_id, date, start, end) tuples to presence CSV file.
+    Returns number of written rows.
+    """
+    count = 0
+    with open(path, 'w') as csvfile:
+        presence_writer = csv.writer(csvfile, delimiter=',')
+        for row in rows:
+            presence_writer.writerow(format_row(*row))
+            count += 1
+    return count
+
+
+def format_row(user_id, date, start, end):
+    """
+    Formats presence entry as CSV row.
+    """
+    return [
+        user_id,
+        date.isoformat(),
+        start.strftime('%H:%M:%S'),
+        end.strftime('%H:%M:%S'),
+    ]
+
+
+def partition_csv(path, directory, date_format='%Y-%m'):
+    """
+    Splits presence CSV file into directory of files partitioned by date,
+    one per month by default. Returns number of written rows.
+    """
+    count = 0
+    files = {}
+    try:
+        for row in read_csv(path):
+            name = row[1].strftime(date_format) + '.csv'
+            if name not in files:
+                csvfile = open(os.path.join(directory, name), 'a')
+                files[name] = (csvfile, csv.writer(csvfile, delimiter=','))
+            files[name][1].writerow(format_row(*row))
+            count += 1
+    finally:
+        for csvfile, _ in files.values():
+            csvfile.close()
+    return count
+
+
+def group_rows(rows):
+    """
+    Groups (user_id, date, start, end) tuples by user_id and date,
+    merging intervals of the same day.
+    """
+    data = {}
+    for user_id, date, start, end in rows:
+        add_interval(data.setdefault(user_id, {}), date, start, end)
+    return data
+
+
+def load_partition(path):
+    """
+    Extracts presence entries of single partition file as tuples of
+    integers, which are much cheaper to pass between processes.
+    """
+    return [
+        (
+            user_id,
+            date.toordinal(),
+            seconds_since_midnight(start),
+            seconds_since_midnight(end),
+        )
+        for user_id, date, start, end in read_csv(path)
+    ]
+
+
+def scan_partition(path):
+    """
+    Returns manifest entry of partition file: its user ids and date bounds.
+    """
+    users = set()
+    first = last = None
+    for user_id, date, _, _ in read_csv(path):
+        users.add(user_id)
+        first = date if first is None else min(first, date)
+        last = date if last is None else max(last, date)
+    return {
+        'users': sorted(users),
+        'first': first and first.isoformat(),
+        'last': last and last.isoformat(),
+        'version': file_version(path),
+    }
+
+
+def file_version(path):
+    """
+    Returns token which changes whenever given file is modified.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return '{0:.6f}-{1}'.format(stat.st_mtime, stat.st_size)
+
+
+def empty_weekday_stats():
+    """
+    Returns weekday statistics structure with no presence entries.
+    """
+    return {
+        i: {'total': 0, 'mean': 0, 'start': 0, 'end': 0}
+        for i in range(7)
+    }
+
+
+def compute_weekday_stats(items):
+    """
+    Computes total, mean presence and mean start, end of presence entries
+    grouped by weekday.
+    """
+    intervals = group_by_weekday(items)
+    starts_ends = count_avg_group_by_weekday(items)
+    result = empty_weekday_stats()
+    for weekday, stats in result.items():
+        stats['total'] = sum(intervals[weekday])
+        stats['mean'] = mean(intervals[weekday])
+        stats['start'] = mean(starts_ends[weekday]['start'])
+        stats['end'] = mean(starts_ends[weekday]['end'])
+    return result
+
+
+def _day_summaries(data):
+    """
+    Yields day summaries of presence data grouped by user_id and date.
+    """
+    for user_id, days in data.items():
+        for date, day in days.items():
+            yield (
+                user_id,
+                date,
+                seconds_since_midnight(day['start']),
+                seconds_since_midnight(day['end']),
+                presence_time(day),
+            )
+
+
+class CSVStorage(object):
+    """
+    Flat CSV file storage, every load parses the whole file.
+    """
+    name = 'csv'
+
+    def __init__(self, config):
+        self.path = config['DATA_CSV']
+
+    def rows(self):
+        """
+        Yields (user_id, date, start, end) tuples of all presence entries.
+        """
+        return read_csv(self.path)
+
+    def data_version(self):
+        """
+        Returns token which changes whenever presence data changes.
+        """
+        return file_version(self.path)
+
+    def load(self):
+        """
+        Extracts presence data and groups it by user_id.
+        """
+        return group_rows(self.rows())
+
+    def has_user(self, user_id):
+        """
+        Checks if there is any presence entry of given user.
+        """
+        return user_id in get_data()
+
+    def day_summaries(self):
+        """
+        Yields (user_id, date, start, end, presence) tuples of every day,
+        times in seconds since midnight, presence of merged intervals.
+        """
+        return _day_summaries(get_data())
+
+    def weekday_stats(self, user_id):
+        """
+        Computes total, mean presence and mean start, end of given user
+        grouped by weekday.
+        """
+        return compute_weekday_stats(get_data().get(user_id, {}))
+
+
+class PartitionedStorage(CSVStorage):
+    """
+    Directory of presence CSV files partitioned by time, e.g. one per
+    month. Manifest of per-partition user sets and date bounds lets
+    queries skip partitions which cannot contain matching entries.
+    """
+    name = 'partitioned'
+    manifest_name = 'manifest.json'
+    suffixes = ('.csv', '.csv.gz', '.csv.bz2', '.csv.xz')
+    # seconds manifest is trusted while directory is not modified
+    rescan_interval = 5
+    # manifests read by directory path: (directory version, time, manifest)
+    manifests = {}
+
+    def __init__(self, config):  # pylint: disable-msg=W0231
+        self.path = config['DATA_DIR']
+        # forking from threaded server may deadlock, parallel load is
+        # meant for command line tools and benchmarks
+        self.workers = config.get('DATA_LOAD_WORKERS', 1)
+
+    def manifest(self):
+        """
+        Returns manifest of partitions. It is read again once directory
+        is modified, e.g. by partition_presence command, or rescan
+        interval passes, so partitions appended in place are noticed too.
+        """
+        version = file_version(self.path)
+        cached = self.manifests.get(self.path)
+        if cached is not None and cached[0] == version and \
+                time.time() - cached[1] < self.rescan_interval:
+            return cached[2]
+        manifest, written = self.scan_manifest()
+        if written:
+            version = file_version(self.path)
+        self.manifests[self.path] = (version, time.time(), manifest)
+        return manifest
+
+    def scan_manifest(self):
+        """
+        Rescans partitions changed since manifest was written, writes it
+        if anything changed. Returns manifest and whether it was written.
+        """
+        path = os.path.join(self.path, self.manifest_name)
+        try:
+            with open(path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (IOError, ValueError):
+            manifest = {}
+
+        current = {}
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(self.suffixes):
+                continue
+            partition = os.path.join(self.path, name)
+            entry = manifest.get(name)
+            if entry is None or entry['version'] != file_version(partition):
+                entry = scan_partition(partition)
+            current[name] = entry
+
+        if current == manifest:
+            return current, False
+        # written atomically, other processes may read or rescan meanwhile
+        temporary = '{0}.{1}.{2}.tmp'.format(
+            path, os.getpid(), threading.current_thread().ident,
+        )
+        with open(temporary, 'w') as manifest_file:
+            json.dump(current, manifest_file)
+        os.rename(temporary, path)
+        return current, True
+
+    def partitions(self, users=None, start=None, end=None):
+        """
+        Returns paths of partitions which may contain entries of given
+        users between start and end dates.
+        """
+        result = []
+        for name, entry in sorted(self.manifest().items()):
+            if not entry['users']:
+                continue
+            if users is not None and not set(users) & set(entry['users']):
+                continue
+            if start is not None and entry['last'] < start.isoformat():
+                continue
+            if end is not None and entry['first'] > end.isoformat():
+                continue
+            result.append(os.path.join(self.path, name))
+        return result
+
+    def rows(self, users=None, start=None, end=None):
+        """
+        Yields (user_id, date, start, end) tuples of presence entries,
+        optionally only of given users between start and end dates.
+        """
+        for path in self.partitions(users, start, end):
+            for row in read_csv(path):
+                if users is not None and row[0] not in users:
+                    continue
+                if start is not None and row[1] < start:
+                    continue
+                if end is not None and row[1] > end:
+                    continue
+                yield row
+
+    def load(self, users=None, start=None, end=None):
+        """
+        Extracts presence data and groups it by user_id. Whole data set is
+        loaded by pool of DATA_LOAD_WORKERS processes, one per partition.
+        """
+        paths = self.partitions(users, start, end)
+        if (users, start, end) != (None, None, None) or \
+                self.workers < 2 or len(paths) < 2:
+            return group_rows(self.rows(users, start, end))
+
+        pool = multiprocessing.Pool(min(self.workers, len(paths)))
+        try:
+            partitions = pool.map(load_partition, paths)
+        finally:
+            pool.close()
+            pool.join()
+        return group_rows(
+            (
+                user_id,
+                date_cls.fromordinal(date),
+                from_seconds(start),
+                from_seconds(end),
+            )
+            for partition in partitions
+            for user_id, date, start, end in partition
+        )
+
+    def has_user(self, user_id):
+        """
+        Checks if there is any presence entry of given user.
+        """
+        return any(
+            user_id in entry['users'] for entry in self.manifest().values()
+        )
+
+    def day_summaries(self):
+        """
+        Yields (user_id, date, start, end, presence) tuples of every day,
+        reading one partition at a time. Partitions are split by date, so
+        each day is in one partition.
+        """
+        for path in self.partitions():
+            for summary in _day_summaries(group_rows(read_csv(path))):
+                yield summary
+
+    def weekday_stats(self, user_id):
+        """
+        Computes total, mean presence and mean start, end of given user
+        grouped by weekday, reading only partitions with entries of user.
+        """
+        return compute_weekday_stats(
+            self.load(users=[user_id]).get(user_id, {}),
+        )
+
+    def data_version(self):
+        """
+        Returns token which changes whenever presence data changes.
+        """
+        return hashlib.md5(json.dumps(sorted(
+            (name, entry['version'])
+            for name, entry in self.manifest().items()
+        ))).hexdigest()
+
+
+class SQLiteStorage(object):
+    """
+    Local SQLite database storage with weekday aggregates computed in SQL.
+    """
+    name = 'sqlite'
+    # bumped whenever schema changes, database is then imported again
+    version = 3
+    tables = ('presence', 'presence_day', 'presence_weekday', 'meta')
+    schema = (
+        # source CSV path and its file version at last import
+        'CREATE TABLE IF NOT EXISTS meta ('
+        ' key TEXT PRIMARY KEY,'
+        ' value TEXT'
+        ')',
+        # every presence interval, several per day are possible
+        'CREATE TABLE IF NOT EXISTS presence ('
+        ' user_id INTEGER NOT NULL,'
+        ' date TEXT NOT NULL,'
+        ' weekday INTEGER NOT NULL,'
+        ' start INTEGER NOT NULL,'
+        ' end INTEGER NOT NULL'
+        ')',
+        'CREATE INDEX IF NOT EXISTS presence_user_date'
+        ' ON presence (user_id, date)',
+        # first arrival, last departure and merged presence time of day
+        'CREATE TABLE IF NOT EXISTS presence_day ('
+        ' user_id INTEGER NOT NULL,'
+        ' date TEXT NOT NULL,'
+        ' weekday INTEGER NOT NULL,'
+        ' start INTEGER NOT NULL,'
+        ' end INTEGER NOT NULL,'
+        ' presence INTEGER NOT NULL,'
+        ' PRIMARY KEY (user_id, date)'
+        ')',
+        'CREATE TABLE IF NOT EXISTS presence_weekday ('
+        ' user_id INTEGER NOT NULL,'
+        ' weekday INTEGER NOT NULL,'
+        ' total INTEGER NOT NULL,'
+        ' mean REAL NOT NULL,'
+        ' start REAL NOT NULL,'
+        ' end REAL NOT NULL,'
+        ' PRIMARY KEY (user_id, weekday)'
+        ')',
+    )
+    # versions of DATA_CSV databases were last checked against, by path
+    ensured = {}
+    ensure_lock = threading.Lock()
+
+    def __init__(self, config):
+        self.path = config['DATA_SQLITE']
+        self.csv_path = config.get('DATA_CSV')
+
+    def connect(self):
+        """
+        Opens connection to database, creating schema if needed. Tables of
+        previous schema version are dropped.
+        Connections are not shared between threads.
+        """
+        import sqlite3
+        connection = sqlite3.connect(self.path)
+        if connection.execute('PRAGMA user_version').fetchone()[0] != \
+                self.version:
+            for table in reversed(self.tables):
+                connection.execute('DROP TABLE IF EXISTS {0}'.format(table))
+            for statement in self.schema:
+                connection.execute(statement)
+            connection.execute('PRAGMA user_version = {0:d}'.format(
+                self.version,
+            ))
+            connection.commit()
+        return connection
+
+    def imported(self):
+        """
+        Returns source path and file version of last imported CSV file,
+        (None, None) if database was not imported with current schema.
+        """
+        if not os.path.exists(self.path):
+            return None, None
+        connection = self.connect()
+        try:
+            meta = dict(connection.execute('SELECT key, value FROM meta'))
+        finally:
+            connection.close()
+        return meta.get('source'), meta.get('version')
+
+    def ensure(self):
+        """
+        Imports DATA_CSV file if database does not exist yet, was created
+        with previous schema version or the file changed since it was
+        imported. Database imported from another file by import_presence
+        command is left alone.
+
+        One thread imports at a time. Others keep using database imported
+        before, they wait only if this process has not checked it yet.
+        """
+        if not self.csv_path:
+            return
+        current = file_version(self.csv_path)
+        if current is None or self.ensured.get(self.path) == current:
+            return
+        if not self.ensure_lock.acquire(False):
+            if self.path in self.ensured:
+                return
+            self.ensure_lock.acquire()
+        try:
+            if self.ensured.get(self.path) == current:
+                return
+            source, version = self.imported()
+            if source in (None, os.path.abspath(self.csv_path)) and \
+                    version != current:
+                log.info('Importing %s into %s', self.csv_path, self.path)
+                self.import_csv(self.csv_path)
+            self.ensured[self.path] = current
+        finally:
+            self.ensure_lock.release()
+
+    def import_csv(self, path, stats=None, progress=None):
+        """
+        Replaces database content with rows read from presence CSV file
+        and rebuilds weekday aggregates. Returns number of imported rows.
+
+        Rows are streamed into database, so memory usage does not depend
+        on file size. Optional progress callable wraps rows iterator.
+        """
+        rows = (
+            (
+                user_id,
+                date.isoformat(),
+                date.weekday(),
+                seconds_since_midnight(start),
+                seconds_since_midnight(end),
+            )
+            for user_id, date, start, end in read_csv(path, stats)
+        )
+        if progress is not None:
+            rows = progress(rows)
+        # version before reading, rows appended meanwhile are imported later
+        version = file_version(path)
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute('DELETE FROM presence')
+                cursor = connection.executemany(
+                    'INSERT INTO presence VALUES (?, ?, ?, ?, ?)',
+                    rows,
+                )
+                self.build_aggregates(connection)
+                connection.executemany(
+                    'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                    [('source', os.path.abspath(path)), ('version', version)],
+                )
+            return cursor.rowcount
+        finally:
+            connection.close()
+
+    def data_version(self):
+        """
+        Returns token which changes whenever presence data changes.
+        """
+        self.ensure()
+        return file_version(self.path)
+
+    @staticmethod
+    def build_aggregates(connection):
+        """
+        Precomputes day summaries, merging intervals of each day, and
+        weekday statistics of every user. Intervals are streamed in day
+        order, so only one day is held in memory.
+        """
+        def days(intervals):
+            """
+            Yields presence_day rows of ordered intervals.
+            """
+            for (user_id, date, weekday), day in itertools.groupby(
+                    intervals, key=lambda row: row[:3]):
+                ranges = []
+                for _, _, _, start, end in day:
+                    merge_interval(ranges, start, end)
+                yield (
+                    user_id, date, weekday, ranges[0][0], ranges[-1][1],
+                    sum(end - start for start, end in ranges),
+                )
+
+        connection.execute('DELETE FROM presence_day')
+        connection.executemany(
+            'INSERT INTO presence_day VALUES (?, ?, ?, ?, ?, ?)',
+            days(connection.cursor().execute(
+                'SELECT user_id, date, weekday, start, end FROM presence'
+                ' ORDER BY user_id, date, start'
+            )),
+        )
+        connection.execute('DELETE FROM presence_weekday')
+        connection.execute(
+            'INSERT INTO presence_weekday'
+            ' SELECT user_id, weekday, SUM(presence), AVG(presence),'
+            ' AVG(start), AVG(end) FROM presence_day GROUP BY user_id, weekday'
+        )
+
+    def query(self, sql, params=()):
+        """
+        Executes query and returns all fetched rows.
+        """
+        self.ensure()
+        connection = self.connect()
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    def rows(self):
+        """
+        Yields (user_id, date, start, end) tuples of all presence entries.
+        """
+        self.ensure()
+        connection = self.connect()
+        try:
+            for user_id, date, start, end in connection.execute(
+                    'SELECT user_id, date, start, end FROM presence'
+                    ' ORDER BY user_id, date, start'):
+                yield (
+                    user_id,
+                    date_cls(*[int(part) for part in date.split('-')]),
+                    from_seconds(start),
+                    from_seconds(end),
+                )
+        finally:
+            connection.close()
+
+    def load(self):
+        """
+        Extracts presence data and groups it by user_id.
+        """
+        return group_rows(self.rows())
+
+    def day_summaries(self):
+        """
+        Yields (user_id, date, start, end, presence) tuples of every day
+        from precomputed day summaries.
+        """
+        for user_id, date, start, end, presence in self.query(
+                'SELECT user_id, date, start, end, presence'
+                ' FROM presence_day'):
+            yield (
+                user_id,
+                date_cls(*[int(part) for part in date.split('-')]),
+                start,
+                end,
+                presence,
+            )
+
+    def has_user(self, user_id):
+        """
+        Checks if there is any presence entry of given user.
+        """
+        return bool(self.query(
+            'SELECT 1 FROM presence_weekday WHERE user_id = ? LIMIT 1',
+            (user_id,),
+        ))
+
+    def weekday_stats(self, user_id):
+        """
+        Computes total, mean presence and mean start, end of given user
+        grouped by weekday.
+        """
+        result = empty_weekday_stats()
+        for weekday, total, avg, start, end in self.query(
+                'SELECT weekday, total, mean, start, end'
+                ' FROM presence_weekday WHERE user_id = ?', (user_id,)):
+            result[weekday] = {
+                'total': total,
+                'mean': avg,
+                'start': start,
+                'end': end,
+            }
+        return result
+
+
+def from_seconds(value):
+    """
+    Converts seconds since midnight to datetime.time object.
+    """
+    return time_cls(value // 3600, value % 3600 // 60, value % 60)
+
+
+BACKENDS = {
+    CSVStorage.name: CSVStorage,
+    PartitionedStorage.name: PartitionedStorage,
+    SQLiteStorage.name: SQLiteStorage,
+}
+
+
+def get_storage():
+    """
+    Returns storage backend selected by DATA_BACKEND config option.
+    """
+    backend = app.config.get('DATA_BACKEND', CSVStorage.name)
+    if backend not in BACKENDS:
+        raise ValueError('Unknown storage backend: {0}'.format(backend))
+    return BACKENDS[backend](app.config)
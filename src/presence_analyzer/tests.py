@@ -7,9 +7,28 @@ from __future__ import unicode_literals
 import datetime
 import json
 import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
-from presence_analyzer import main, views, utils
+from presence_analyzer import (
+    assets,
+    charts,
+    events,
+    loadtest,
+    rankings,
+    main,
+    memory,
+    profiles,
+    sharedcache,
+    storage,
+    utils,
+    views,
+)
 
 
 TEST_DATA_CSV = os.path.join(
@@ -25,6 +44,27 @@ TEST_CACHE_DATA_CSV = os.path.join(
 )
 
 
+def _shared_cache_worker(arguments):
+    """
+    Reads keys through shared cache, counting computations in log file.
+    Returns hits and misses of this worker.
+    """
+    directory, keys, log_path = arguments
+    sharedcache.STATS.update(hits=0, misses=0)
+    shared = sharedcache.SharedCache(directory, 'version')
+
+    def compute(key):
+        with open(log_path, 'a') as log_file:
+            log_file.write(key + '\n')
+        time.sleep(0.02)
+        return 'value of ' + key
+
+    for key in keys:
+        assert shared.get_or_compute(key, 60, lambda: compute(key)) == \
+            'value of ' + key
+    return sharedcache.STATS['hits'], sharedcache.STATS['misses']
+
+
 # pylint: disable=E1103
 class PresenceAnalyzerViewsTestCase(unittest.TestCase):
     """
@@ -87,6 +127,38 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
             ]
         )
 
+    def test_api_users_v3(self):
+        """
+        Test users listing joined from presence data and profiles.
+        """
+        resp = self.client.get('/api/v3/users')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/json')
+        test_data = json.loads(resp.data)
+        self.assertEqual(
+            [user['user_id'] for user in test_data], [141, 176, 10, 11],
+        )
+        self.assertEqual(test_data[0], {
+            'user_id': 141,
+            'name': 'Adam P.',
+            'image': 'https://intranet.stxnext.pl/api/images/users/141',
+            'has_profile': True,
+            'has_data': False,
+            'first_date': None,
+            'last_date': None,
+            'days': 0,
+        })
+        self.assertEqual(test_data[2], {
+            'user_id': 10,
+            'name': 'User 10',
+            'image': None,
+            'has_profile': False,
+            'has_data': True,
+            'first_date': '2013-09-10',
+            'last_date': '2013-09-12',
+            'days': 3,
+        })
+
     def test_mean_time_weekday_view(self):
         """
         Checking inversed presence time of given user grouped by weekday.
@@ -143,6 +215,34 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
             ['Sun', 0, 0],
         ])
 
+    def test_health(self):
+        """
+        Test readiness reporting.
+        """
+        resp = self.client.get('/health')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(json.loads(resp.data)['ready'])
+        utils.STATUS['ready'] = False
+        try:
+            resp = self.client.get('/health')
+            self.assertEqual(resp.status_code, 503)
+        finally:
+            utils.STATUS['ready'] = True
+
+    def test_overloaded(self):
+        """
+        Test shed request is answered with 503 and Retry-After.
+        """
+        with main.app.test_request_context():
+            resp = views.overloaded_view(utils.Overloaded('data', 3))
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '3')
+
+        resp = self.client.get('/admin/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('data', json.loads(resp.data)['admission'])
+        self.assertIn('hits', json.loads(resp.data)['shared_cache'])
+
     def test_templates_render(self):
         """
         Testing returned templates.
@@ -163,6 +263,172 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         self.assertIn('page not found', resp.data)
         self.assertEqual(resp.status_code, 404)
 
+    def test_templates_render_cache(self):
+        """
+        Testing rendered pages and template names are cached.
+        """
+        utils.CACHE = {}
+        resp = self.client.get('/presence_weekday')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(('page', ('presence_weekday', None, None), ()),
+                      utils.CACHE)
+        self.assertEqual(
+            utils.page_templates(None),
+            set(['presence_weekday', 'mean_time_weekdays',
+                 'presence_start_end']),
+        )
+
+        resp = self.client.get('/template_base')
+        self.assertEqual(resp.status_code, 404)
+
+        self.assertIsNone(utils.templates_version())
+        main.app.debug = True
+        try:
+            self.assertIsNotNone(utils.templates_version())
+        finally:
+            main.app.debug = False
+        utils.CACHE = {}
+
+    def test_static_assets(self):
+        """
+        Testing fingerprinted, precompressed static assets.
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            manifest = assets.build_assets(main.app.static_folder, tmpdir)
+            self.assertRegexpMatches(
+                manifest['css/style.css'], r'^css/style\.[0-9a-f]{8}\.css$',
+            )
+            self.assertTrue(os.path.exists(
+                os.path.join(tmpdir, manifest['css/style.css'] + '.gz'),
+            ))
+            main.app.config['ASSETS_DIR'] = tmpdir
+            utils.CACHE = {}
+
+            resp = self.client.get('/presence_weekday')
+            self.assertIn('/static/' + manifest['css/style.css'], resp.data)
+
+            url = '/static/' + manifest['js/jquery.min.js']
+            resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.headers['Cache-Control'], assets.IMMUTABLE)
+            self.assertIn('javascript', resp.content_type)
+            resp.close()
+
+            resp = self.client.get(url)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            resp.close()
+
+            resp = self.client.get('/static/css/style.css')
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers.get('Cache-Control'),
+                                assets.IMMUTABLE)
+            resp.close()
+        finally:
+            main.app.config['ASSETS_DIR'] = None
+            utils.CACHE = {}
+            shutil.rmtree(tmpdir)
+
+    def test_templates_render_embedded_chart(self):
+        """
+        Testing chart table embedded in rendered page.
+        """
+        resp = self.client.get('/presence_start_end?user_id=10')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('initial: {"user_id": 10, "user": null, "table": {',
+                      resp.data)
+        self.assertIn('"f": "09:39:05"', resp.data)
+
+        resp = self.client.get('/presence_weekday')
+        self.assertIn('initial: null', resp.data)
+
+    def test_ranking_view(self):
+        """
+        Testing users ranking.
+        """
+        resp = self.client.get('/api/v1/ranking/start')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/json')
+        self.assertEqual(json.loads(resp.data), [
+            {'user_id': 10, 'name': 'User 10', 'value': 35754.333333333336},
+            {'user_id': 11, 'name': 'User 11', 'value': 36491.666666666664},
+        ])
+
+        resp = self.client.get(
+            '/api/v1/ranking/total?order=desc&limit=1&weekday=3'
+            '&start=2013-09-01&end=2013-09-30'
+        )
+        self.assertEqual(json.loads(resp.data), [
+            {'user_id': 11, 'name': 'User 11', 'value': 45968},
+        ])
+        # repeated weekday is counted once
+        resp = self.client.get(
+            '/api/v1/ranking/total?order=desc&limit=1&weekday=3&weekday=3'
+            '&start=2013-09-01&end=2013-09-30'
+        )
+        self.assertEqual(json.loads(resp.data)[0]['value'], 45968)
+
+        resp = self.client.get('/api/v1/ranking/start?weekday=5')
+        self.assertEqual(json.loads(resp.data), [])
+
+        self.assertEqual(
+            self.client.get('/api/v1/ranking/bad').status_code, 404,
+        )
+        self.assertEqual(
+            self.client.get('/api/v1/ranking/end?weekday=7').status_code, 400,
+        )
+        self.assertEqual(
+            self.client.get('/api/v1/ranking/end?start=x').status_code, 400,
+        )
+
+    def test_chart_view(self):
+        """
+        Testing chart-ready data tables.
+        """
+        resp = self.client.get('/api/v1/chart/presence_weekday/10')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_type, 'application/json')
+        table = json.loads(resp.data)
+        self.assertEqual(len(table['cols']), 2)
+        self.assertEqual(table['rows'][1], {'c': [{'v': 'Tue'}, {'v': 30047}]})
+
+        resp = self.client.get('/api/v1/chart/presence_start_end/12')
+        self.assertEqual(json.loads(resp.data), None)
+
+        resp = self.client.get('/api/v1/chart/bad_chart/10')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_chart_view_data_changed(self):
+        """
+        Test chart tables follow changes of presence data.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'data.csv')
+            shutil.copy(TEST_DATA_CSV, path)
+            main.app.config['DATA_CSV'] = path
+            resp = self.client.get('/api/v1/chart/presence_weekday/99')
+            self.assertEqual(json.loads(resp.data), None)
+            resp = self.client.get('/api/v1/users')
+            self.assertNotIn(99, [u['user_id'] for u in json.loads(resp.data)])
+            resp = self.client.get('/api/v1/presence_weekday/99')
+            self.assertEqual(json.loads(resp.data), [])
+            with open(path, 'a') as csv_file:
+                csv_file.write('\n99,2013-09-16,09:00:00,17:00:00\n')
+            resp = self.client.get('/api/v1/chart/presence_weekday/99')
+            self.assertEqual(json.loads(resp.data)['rows'][0],
+                             {'c': [{'v': 'Mon'}, {'v': 28800}]})
+            resp = self.client.get('/api/v1/users')
+            self.assertIn(99, [u['user_id'] for u in json.loads(resp.data)])
+            resp = self.client.get('/api/v1/presence_weekday/99')
+            self.assertEqual(json.loads(resp.data)[1], ['Mon', 28800])
+            resp = self.client.get('/presence_weekday?user_id=99')
+            self.assertIn('{"v": "Mon"}, {"v": 28800}', resp.data)
+        finally:
+            main.app.config['DATA_CSV'] = TEST_DATA_CSV
+            shutil.rmtree(directory)
+
 
 class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
     """
@@ -216,6 +482,61 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         }, test_data.values())
         self.assertItemsEqual(test_data[141].keys(), ['image', 'name'])
 
+    def test_user_index_rebuilt(self):
+        """
+        Test user index follows changes of profiles and presence data.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            xml_path = os.path.join(directory, 'users.xml')
+            csv_path = os.path.join(directory, 'data.csv')
+            shutil.copy(TEST_DATA_XML, xml_path)
+            shutil.copy(TEST_DATA_CSV, csv_path)
+            main.app.config.update({
+                'DATA_XML': xml_path,
+                'DATA_CSV': csv_path,
+            })
+            self.assertFalse(profiles.user_index()[10]['has_profile'])
+            self.assertNotIn(99, profiles.user_index())
+            with open(xml_path) as xml_file:
+                content = xml_file.read()
+            with open(xml_path, 'w') as xml_file:
+                xml_file.write(content.replace('<users>', (
+                    '<users><user id="10"><avatar>/10</avatar>'
+                    '<name>Ola T.</name></user>'
+                )))
+            with open(csv_path, 'a') as csv_file:
+                csv_file.write('\n99,2013-09-16,09:00:00,17:00:00\n')
+            user = profiles.user_index()[10]
+            self.assertTrue(user['has_profile'])
+            self.assertTrue(user['has_data'])
+            self.assertEqual(user['name'], 'Ola T.')
+            self.assertTrue(profiles.user_index()[99]['has_data'])
+            self.assertIn(
+                99, [user['user_id'] for user in json.loads(
+                    main.app.test_client().get('/api/v3/users').data
+                )],
+            )
+        finally:
+            main.app.config.update({
+                'DATA_XML': TEST_DATA_XML,
+                'DATA_CSV': TEST_DATA_CSV,
+            })
+            shutil.rmtree(directory)
+
+    def test_collation_key(self):
+        """
+        Test names are ordered by Polish alphabet, with or without pl_PL
+        locale installed.
+        """
+        names = [u'Zenon A.', u'\u0141ukasz K.', u'\u0141ukasz J.',
+                 u'Lech B.', 'Adam P.']
+        expected = [u'Adam P.', u'Lech B.', u'\u0141ukasz J.',
+                    u'\u0141ukasz K.', u'Zenon A.']
+        self.assertEqual(sorted(names, key=profiles._alphabet_key), expected)
+        self.assertEqual(sorted(names, key=profiles.collation_key()),
+                         expected)
+
     def test_group_by_weekday(self):
         """
         Test groups presence entries by weeekday.
@@ -243,6 +564,55 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
             6: [],
         }, result)
 
+    def test_merge_interval(self):
+        """
+        Test inserting ranges into sorted disjoint ranges.
+        """
+        ranges = []
+        utils.merge_interval(ranges, 50, 60)
+        utils.merge_interval(ranges, 10, 20)
+        utils.merge_interval(ranges, 30, 40)
+        self.assertEqual(ranges, [(10, 20), (30, 40), (50, 60)])
+        utils.merge_interval(ranges, 15, 30)
+        self.assertEqual(ranges, [(10, 40), (50, 60)])
+        utils.merge_interval(ranges, 0, 100)
+        self.assertEqual(ranges, [(0, 100)])
+
+    def test_add_interval(self):
+        """
+        Test keeping several presence intervals of a day.
+        """
+        date = datetime.date(2013, 9, 10)
+        days = {}
+        utils.add_interval(
+            days, date, datetime.time(9, 0, 0), datetime.time(12, 0, 0),
+        )
+        self.assertEqual(days[date], {
+            'start': datetime.time(9, 0, 0),
+            'end': datetime.time(12, 0, 0),
+        })
+        utils.add_interval(
+            days, date, datetime.time(13, 0, 0), datetime.time(17, 0, 0),
+        )
+        utils.add_interval(
+            days, date, datetime.time(11, 0, 0), datetime.time(12, 30, 0),
+        )
+        self.assertEqual(days[date], {
+            'start': datetime.time(9, 0, 0),
+            'end': datetime.time(17, 0, 0),
+            'intervals': [(32400, 45000), (46800, 61200)],
+        })
+        self.assertEqual(utils.presence_time(days[date]), 27000)
+        self.assertEqual(utils.group_by_weekday(days)[1], [27000])
+        self.assertEqual(
+            utils.count_avg_group_by_weekday(days)[1],
+            {'start': [32400], 'end': [61200]},
+        )
+        utils.add_interval(
+            days, date, datetime.time(8, 0, 0), datetime.time(18, 0, 0),
+        )
+        self.assertNotIn('intervals', days[date])
+
     def test_seconds_since_midnight(self):
         """
         Testing results of seconds_since_midnight function.
@@ -345,18 +715,942 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
             }
         )
 
+    def test_chart_time(self):
+        """
+        Test converting seconds to chart datetime cells.
+        """
+        self.assertEqual(charts.chart_time(34745), {
+            'v': 'Date(1, 1, 1, 9, 39, 5, 0)',
+            'f': '09:39:05',
+        })
+        self.assertEqual(charts.chart_time(0.5), {
+            'v': 'Date(1, 1, 1, 0, 0, 0, 500)',
+            'f': '00:00:00',
+        })
+
+    def test_rank(self):
+        """
+        Test selecting users with smallest and largest metric values.
+        """
+        self.assertEqual(
+            rankings.rank('mean', limit=1), [(11, 19733.666666666668)],
+        )
+        self.assertEqual(
+            rankings.rank('end', limit=5, largest=True, weekdays=[1]),
+            [(10, 64792.0), (11, 50154.0)],
+        )
+        self.assertEqual(
+            rankings.rank('total', start=datetime.date(2013, 9, 12)),
+            [(10, 23705), (11, 29395)],
+        )
+        entries = len(utils.CACHE)
+        self.assertEqual(
+            rankings.rank('start', start=datetime.date(2013, 9, 10),
+                          end=datetime.date(2013, 9, 11)),
+            [(11, 33398.0), (10, 34168.5)],
+        )
+        self.assertEqual(
+            rankings.rank('start', start=datetime.date(2013, 9, 14),
+                          end=datetime.date(2013, 9, 30)),
+            [],
+        )
+        # date ranges are summed from one index, not cached separately
+        self.assertEqual(len(utils.CACHE), entries)
+
     def test_cache(self):
         """
         Cache test.
         """
         first_data = utils.get_data()
+        self.assertIs(utils.get_data(), first_data)
+        # data is loaded again once it changes
         main.app.config.update({'DATA_CSV': TEST_CACHE_DATA_CSV})
         second_data = utils.get_data()
-        self.assertDictEqual(first_data, second_data)
-        utils.CACHE = {}
-        second_data = utils.get_data()
         self.assertNotEqual(first_data, second_data)
+        self.assertIs(utils.get_data(), second_data)
+        utils.CACHE = {}
+
+    def test_cache_arguments(self):
+        """
+        Test caching per function arguments.
+        """
+        calls = []
+
+        @utils.cache('square', 600)
+        def square(value):
+            """
+            Squares and counts calls.
+            """
+            calls.append(value)
+            return value * value
+
+        self.assertEqual(square(2), 4)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(2), 4)
+        self.assertEqual(calls, [2, 3])
+        utils.CACHE = {}
+
+    def test_sweep_cache(self):
+        """
+        Test expired items cached per arguments are swept, items under
+        fixed keys are kept.
+        """
+        utils.CACHE = {}
+
+        @utils.cache('square', 0)
+        def square(value):
+            """
+            Squares value.
+            """
+            return value * value
+
+        @utils.cache('fixed', 0)
+        def fixed():
+            """
+            Returns constant.
+            """
+            return 1
+
+        fixed()
+        for value in range(100):
+            square(value)
+        self.assertEqual(len(utils.CACHE), 101)
+        utils.sweep_cache()
+        self.assertEqual(utils.CACHE.keys(), ['fixed'])
+        utils.CACHE = {}
+
+    def test_admission(self):
+        """
+        Test concurrent callers share single call and are shed once
+        queue is full.
+        """
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        @utils.admission('test')
+        def slow(value):
+            """
+            Blocks until released.
+            """
+            calls.append(value)
+            started.set()
+            release.wait()
+            return value * 2
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(slow(2)))
+            for _ in range(2)
+        ]
+        main.app.config['ADMISSION_QUEUE'] = 1
+        try:
+            threads[0].start()
+            started.wait()
+            threads[1].start()
+            while utils.ADMISSION['test']['waiting'] < 1:
+                time.sleep(0.001)
+            with self.assertRaises(utils.Overloaded):
+                slow(2)
+            release.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            release.set()
+            del main.app.config['ADMISSION_QUEUE']
+
+        self.assertEqual(calls, [2])
+        self.assertEqual(results, [4, 4])
+        self.assertEqual(utils.ADMISSION['test']['shed'], 1)
+        self.assertEqual(utils.ADMISSION['test']['max_waiting'], 1)
+        self.assertEqual(utils.ADMISSION['test']['waiting'], 0)
+        del utils.ADMISSION['test']
+
+    def test_cache_stale_when_overloaded(self):
+        """
+        Test expired item is served when resource is overloaded.
+        """
+        overloaded = []
+
+        @utils.cache('stale', 0)
+        def value():
+            """
+            Raises Overloaded once flagged.
+            """
+            if overloaded:
+                raise utils.Overloaded('test', 1)
+            return 'value'
+
+        self.assertEqual(value(), 'value')
+        overloaded.append(True)
+        self.assertEqual(value(), 'value')
+        utils.CACHE = {}
+        with self.assertRaises(utils.Overloaded):
+            value()
+
+    def test_lazy_imports(self):
+        """
+        Test heavy modules are not imported on package import, control
+        commands which do not serve requests do not load the application.
+        """
+        output = subprocess.check_output([
+            sys.executable, '-W', 'ignore', '-c',
+            'import sys, presence_analyzer.script; '
+            'print [m for m in ("lxml", "sqlite3", "paste.script", '
+            '"presence_analyzer.main", "presence_analyzer.views", '
+            '"presence_analyzer.storage", "multiprocessing", "mako", '
+            '"flask_mako") if m in sys.modules]',
+        ], cwd=os.path.join(os.path.dirname(__file__), '..'))
+        self.assertEqual(output.strip(), '[]')
+
+    def test_warm_up_only_when_serving(self):
+        """
+        Test command line configuration does not warm caches up, paste
+        application factory does.
+        """
+        from presence_analyzer import script
+        directory = tempfile.mkdtemp()
+        try:
+            config = os.path.join(directory, 'test.cfg')
+            with open(config, 'w') as config_file:
+                config_file.write(
+                    'DATA_CSV = {0!r}\nDATA_XML = {1!r}\n'
+                    'WARM_UP = True\nWARM_UP_BACKGROUND = False\n'.format(
+                        str(TEST_DATA_CSV), str(TEST_DATA_XML),
+                    )
+                )
+            utils.CACHE = {}
+            utils.STATUS['warm_up_time'] = None
+            script._load_config(config)
+            self.assertIsNone(utils.STATUS['warm_up_time'])
+            self.assertNotIn('user_id', utils.CACHE)
+            script.make_app(config=config)
+            self.assertIsNotNone(utils.STATUS['warm_up_time'])
+            self.assertIn('user_id', utils.CACHE)
+        finally:
+            main.app.config['WARM_UP'] = False
+            utils.CACHE = {}
+            shutil.rmtree(directory)
+
+    def test_warm_up(self):
+        """
+        Test warm-up fills cache with serialized responses.
+        """
+        utils.CACHE = {}
+        utils.warm_up()
+        self.assertTrue(utils.STATUS['ready'])
+        self.assertIsNotNone(utils.STATUS['warm_up_time'])
+        self.assertIn('user_id', utils.CACHE)
+        self.assertIn(('presence_weekday', (), (('user_id', 11),)),
+                      utils.CACHE)
+        utils.CACHE = {}
+
+    def test_warm_up_failed(self):
+        """
+        Test application reports readiness also when warm-up fails.
+        """
+        def failing_get_data():
+            """
+            Fails to load data.
+            """
+            raise IOError('data unavailable')
+
+        get_data = utils.get_data
+        utils.get_data = failing_get_data
+        try:
+            utils.warm_up()
+        finally:
+            utils.get_data = get_data
+        self.assertTrue(utils.STATUS['ready'])
+        self.assertIsNotNone(utils.STATUS['warm_up_time'])
+
+
+class PresenceAnalyzerStorageTestCase(unittest.TestCase):
+    """
+    Storage backends tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML,
+            'DATA_CACHE': TEST_CACHE_DATA_CSV,
+            'DATA_BACKEND': 'sqlite',
+            'DATA_SQLITE': os.path.join(self.tmpdir, 'presence.sqlite'),
+        })
+        utils.CACHE = {}
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config['DATA_BACKEND'] = 'csv'
+        utils.CACHE = {}
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_storage(self):
+        """
+        Test selecting storage backend from config.
+        """
+        self.assertIsInstance(storage.get_storage(), storage.SQLiteStorage)
+        main.app.config['DATA_BACKEND'] = 'csv'
+        self.assertIsInstance(storage.get_storage(), storage.CSVStorage)
+        main.app.config['DATA_BACKEND'] = 'unknown'
+        with self.assertRaises(ValueError):
+            storage.get_storage()
+
+    def test_import_csv(self):
+        """
+        Test importing CSV file into SQLite database.
+        """
+        sqlite = storage.get_storage()
+        self.assertEqual(sqlite.import_csv(TEST_DATA_CSV), 9)
+        self.assertEqual(sqlite.import_csv(TEST_CACHE_DATA_CSV), 7)
+        self.assertItemsEqual(sqlite.load().keys(), [10, 11])
+
+    def test_reimport_changed_csv(self):
+        """
+        Test database is imported again once, when DATA_CSV changes, and
+        old database is used while import is in progress.
+        """
+        path = os.path.join(self.tmpdir, 'presence.csv')
+        shutil.copy(TEST_DATA_CSV, path)
+        main.app.config['DATA_CSV'] = path
+        self.assertFalse(storage.get_storage().has_user(99))
+        with open(path, 'a') as csvfile:
+            csvfile.write('\n99,2013-09-16,09:00:00,17:00:00\n')
+
+        imports = []
+        import_csv = storage.SQLiteStorage.import_csv
+
+        def counting_import_csv(sqlite, *args, **kwargs):
+            """
+            Counts imports.
+            """
+            imports.append(args[0])
+            return import_csv(sqlite, *args, **kwargs)
+
+        storage.SQLiteStorage.import_csv = counting_import_csv
+        try:
+            # requests keep using old database while another thread imports
+            with storage.SQLiteStorage.ensure_lock:
+                self.assertFalse(storage.get_storage().has_user(99))
+            self.assertEqual(imports, [])
+            threads = [
+                threading.Thread(target=storage.get_storage().ensure)
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            storage.SQLiteStorage.import_csv = import_csv
+        self.assertEqual(imports, [path])
+        self.assertTrue(storage.get_storage().has_user(99))
+        resp = self.client.get('/api/v1/presence_weekday/99')
+        self.assertIn(['Mon', 28800], json.loads(resp.data))
+        main.app.config['DATA_CSV'] = TEST_DATA_CSV
+
+    def test_read_csv_stats(self):
+        """
+        Test counting of parsed, skipped and rejected lines.
+        """
+        path = os.path.join(self.tmpdir, 'presence.csv')
+        with open(path, 'w') as csvfile:
+            csvfile.write(
+                'user_id,date,start,end,\n'
+                '10,2013-09-10,09:39:05,17:59:52\n'
+                '10,2013-13-10,09:39:05,17:59:52\n'
+                'x,2013-09-11,09:39:05,17:59:52\n'
+            )
+        stats = {}
+        rows = list(storage.read_csv(path, stats))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(stats, {'rows': 1, 'skipped': 1, 'rejected': 2})
+
+    def test_write_csv(self):
+        """
+        Test exported CSV file reads back the same entries.
+        """
+        path = os.path.join(self.tmpdir, 'export.csv')
+        rows = list(storage.get_storage().rows())
+        self.assertEqual(storage.write_csv(path, rows), 9)
+        self.assertItemsEqual(list(storage.read_csv(path)), rows)
+
+    def test_partitioned_storage(self):
+        """
+        Test partitioning, manifest and partition pruning.
+        """
+        path = os.path.join(self.tmpdir, 'presence.csv')
+        directory = os.path.join(self.tmpdir, 'partitions')
+        os.mkdir(directory)
+        with open(path, 'w') as csvfile:
+            csvfile.write(
+                '10,2013-08-30,09:00:00,17:00:00\n'
+                '10,2013-09-02,09:00:00,17:00:00\n'
+                '11,2013-09-03,10:00:00,16:00:00\n'
+                '11,2013-10-01,10:00:00,16:00:00\n'
+            )
+        self.assertEqual(storage.partition_csv(path, directory), 4)
+        main.app.config.update({
+            'DATA_BACKEND': 'partitioned',
+            'DATA_DIR': directory,
+            'DATA_LOAD_WORKERS': 2,
+        })
+        partitioned = storage.get_storage()
+        manifest = partitioned.manifest()
+        self.assertItemsEqual(
+            manifest.keys(), ['2013-08.csv', '2013-09.csv', '2013-10.csv'],
+        )
+        self.assertEqual(manifest['2013-09.csv']['users'], [10, 11])
+        self.assertEqual(manifest['2013-10.csv']['first'], '2013-10-01')
+        self.assertTrue(os.path.exists(
+            os.path.join(directory, 'manifest.json'),
+        ))
+
+        self.assertEqual(len(partitioned.partitions(users=[11])), 2)
+        self.assertEqual(len(partitioned.partitions(
+            start=datetime.date(2013, 9, 1), end=datetime.date(2013, 9, 30),
+        )), 1)
+        self.assertEqual(list(partitioned.rows(
+            users=[11], end=datetime.date(2013, 9, 30),
+        )), [(
+            11, datetime.date(2013, 9, 3),
+            datetime.time(10, 0, 0), datetime.time(16, 0, 0),
+        )])
+
+        csv_data = storage.CSVStorage({'DATA_CSV': path}).load()
+        self.assertDictEqual(partitioned.load(), csv_data)
+        partitioned.workers = 1
+        self.assertDictEqual(partitioned.load(), csv_data)
+        self.assertTrue(partitioned.has_user(11))
+        self.assertFalse(partitioned.has_user(12))
+
+        # per user statistics read only partitions of that user
+        read = []
+        read_csv = storage.read_csv
+
+        def recording_read_csv(path, *args):
+            """
+            Records read partitions.
+            """
+            read.append(os.path.basename(path))
+            return read_csv(path, *args)
+
+        storage.read_csv = recording_read_csv
+        try:
+            stats = partitioned.weekday_stats(10)
+        finally:
+            storage.read_csv = read_csv
+        self.assertEqual(read, ['2013-08.csv', '2013-09.csv'])
+        self.assertEqual(stats, storage.compute_weekday_stats(csv_data[10]))
+        self.assertItemsEqual(
+            partitioned.day_summaries(),
+            storage.SQLiteStorage({
+                'DATA_SQLITE': os.path.join(self.tmpdir, 'day.sqlite'),
+                'DATA_CSV': path,
+            }).day_summaries(),
+        )
+
+        # partition appended in place is noticed after rescan interval
+        version = partitioned.data_version()
+        with open(os.path.join(directory, '2013-10.csv'), 'a') as csvfile:
+            csvfile.write('12,2013-10-02,10:00:00,16:00:00\n')
+        self.assertFalse(partitioned.has_user(12))
+        partitioned.rescan_interval = 0
+        self.assertNotEqual(partitioned.data_version(), version)
+        self.assertTrue(partitioned.has_user(12))
+
+    def test_compressed_input(self):
+        """
+        Test reading gzip and bz2 compressed data files.
+        """
+        import bz2
+        import gzip
+
+        for suffix, compress in (('gz', gzip.open), ('bz2', bz2.BZ2File)):
+            for source, key in ((TEST_DATA_CSV, 'DATA_CSV'),
+                                (TEST_DATA_XML, 'DATA_XML')):
+                path = os.path.join(
+                    self.tmpdir, '{0}.{1}'.format(key, suffix),
+                )
+                with open(source, 'rb') as datafile:
+                    with compress(path, 'wb') as compressed:
+                        compressed.write(datafile.read())
+                main.app.config[key] = path
+
+            self.assertDictEqual(
+                storage.CSVStorage(main.app.config).load(),
+                storage.CSVStorage({'DATA_CSV': TEST_DATA_CSV}).load(),
+            )
+            utils.CACHE = {}
+            self.assertEqual(utils.get_xml_data()[141]['name'], 'Adam P.')
+            utils.CACHE = {}
+
+    def test_multiple_intervals(self):
+        """
+        Test both backends merge several intervals of a day the same way.
+        """
+        path = os.path.join(self.tmpdir, 'presence.csv')
+        with open(path, 'w') as csvfile:
+            csvfile.write(
+                '10,2013-09-10,13:00:00,17:00:00\n'
+                '10,2013-09-10,09:00:00,12:00:00\n'
+                '10,2013-09-10,11:00:00,12:30:00\n'
+                '10,2013-09-11,09:00:00,17:00:00\n'
+            )
+        main.app.config['DATA_CSV'] = path
+        sqlite = storage.get_storage()
+        csv = storage.CSVStorage(main.app.config)
+        self.assertDictEqual(sqlite.load(), csv.load())
+        self.assertEqual(sqlite.weekday_stats(10), csv.weekday_stats(10))
+        self.assertItemsEqual(sqlite.day_summaries(), [
+            (10, datetime.date(2013, 9, 10), 32400, 61200, 27000),
+            (10, datetime.date(2013, 9, 11), 32400, 61200, 28800),
+        ])
+        self.assertEqual(sqlite.weekday_stats(10)[1], {
+            'total': 27000, 'mean': 27000.0, 'start': 32400.0, 'end': 61200.0,
+        })
+        self.assertEqual(len(list(sqlite.rows())), 4)
+
+    def test_load(self):
+        """
+        Test both backends extract the same data.
+        """
+        csv_data = storage.CSVStorage(main.app.config).load()
+        self.assertDictEqual(storage.get_storage().load(), csv_data)
+        self.assertDictEqual(utils.get_data(), csv_data)
+
+    def test_weekday_stats(self):
+        """
+        Test weekday aggregates computed in SQL match in-memory ones.
+        """
+        sqlite = storage.get_storage()
+        csv = storage.CSVStorage(main.app.config)
+        for user_id in (10, 11, 12):
+            self.assertEqual(
+                sqlite.weekday_stats(user_id), csv.weekday_stats(user_id),
+            )
+        self.assertTrue(sqlite.has_user(10))
+        self.assertFalse(sqlite.has_user(12))
+
+    def test_views(self):
+        """
+        Test views return the same results on both backends.
+        """
+        urls = [
+            '/api/v1/users',
+            '/api/v1/mean_time_weekday/10',
+            '/api/v1/presence_weekday/11',
+            '/api/v1/presence_start_end/11',
+            '/api/v1/presence_start_end/12',
+        ]
+        sqlite_responses = [self.client.get(url).data for url in urls]
+        main.app.config['DATA_BACKEND'] = 'csv'
+        utils.CACHE = {}
+        csv_responses = [self.client.get(url).data for url in urls]
+        self.assertEqual(sqlite_responses, csv_responses)
+
+
+class PresenceAnalyzerLoadTestTestCase(unittest.TestCase):
+    """
+    Load generator tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML,
+            'DATA_CACHE': TEST_CACHE_DATA_CSV
+        })
+
+    def test_parse_mix(self):
+        """
+        Test parsing request mix.
+        """
+        self.assertEqual(
+            loadtest.parse_mix('/api/v1/users:2, /presence_weekday'),
+            (('/api/v1/users', 2), ('/presence_weekday', 1)),
+        )
+
+    def test_percentile(self):
+        """
+        Test nearest-rank percentiles.
+        """
+        values = range(1, 101)
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile([3], 95), 3)
+        self.assertEqual(loadtest.percentile([], 95), 0)
+
+    def test_run(self):
+        """
+        Test in-process load test report.
+        """
+        report = loadtest.run(
+            requests=30,
+            concurrency=3,
+            mix=(('/api/v1/presence_weekday/{user_id}', 1), ('/bad', 1)),
+        )
+        self.assertEqual(report['requests'], 30)
+        self.assertEqual(sum(report['statuses'].values()), 30)
+        self.assertLessEqual(set(report['statuses']), set([200, 404]))
+        self.assertLessEqual(report['p50'], report['p99'])
+        self.assertIn('throughput', loadtest.format_report(report))
+
+
+class PresenceAnalyzerSharedCacheTestCase(unittest.TestCase):
+    """
+    Shared response cache tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML,
+            'DATA_CACHE': TEST_CACHE_DATA_CSV
+        })
+        self.directory = tempfile.mkdtemp()
+        self.client = main.app.test_client()
+        utils.CACHE = {}
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.pop('SHARED_CACHE_DIR', None)
+        utils.CACHE = {}
+        shutil.rmtree(self.directory)
+
+    def test_hit_rate_across_workers(self):
+        """
+        Test each entry is computed by one worker process only.
+        """
+        import multiprocessing
+        log_path = os.path.join(self.directory, 'computed.log')
+        keys = ['key{0}'.format(i) for i in range(5)]
+        pool = multiprocessing.Pool(4)
+        try:
+            results = pool.map(
+                _shared_cache_worker,
+                [(os.path.join(self.directory, 'cache'), keys, log_path)] * 4,
+            )
+        finally:
+            pool.close()
+            pool.join()
+        with open(log_path) as log_file:
+            computed = log_file.read().split()
+        self.assertEqual(sorted(computed), keys)
+        hits = sum(hit for hit, _ in results)
+        misses = sum(miss for _, miss in results)
+        self.assertEqual(misses, 5)
+        self.assertEqual(hits, 15)
+        self.assertEqual(float(hits) / (hits + misses), 0.75)
+
+    def test_expired(self):
+        """
+        Test entries older than duration are not returned.
+        """
+        shared = sharedcache.SharedCache(self.directory, 'version')
+        shared.set('key', 'value', 60)
+        self.assertEqual(shared.get('key', 60), 'value')
+        self.assertIsNone(shared.get('key', 0))
+        self.assertIsNone(shared.get('missing', 60))
+
+    def test_sweep(self):
+        """
+        Test directories of old versions and expired entries are removed,
+        lock files of current version are kept.
+        """
+        old = sharedcache.SharedCache(self.directory, 'old')
+        old.get_or_compute('key', 60, lambda: 'old value')
+        self.assertEqual(len(os.listdir(old.directory)), 2)
+        past = time.time() - 3600
+        os.utime(old.directory, (past, past))
+
+        shared = sharedcache.SharedCache(self.directory, 'new')
+        shared.set('expired', 'value', 60)
+        os.utime(shared.path('expired'), (past, past))
+        # lock held by process computing entry for long is kept
+        with shared.lock('computed'):
+            os.utime(shared.path('computed') + '.lock', (past, past))
+            sharedcache.SWEPT.pop(self.directory, None)
+            shared.set('key', 'new value', 60)
+        self.assertEqual(os.listdir(self.directory),
+                         [os.path.basename(shared.directory)])
+        self.assertEqual(sorted(os.listdir(shared.directory)), sorted([
+            os.path.basename(shared.path('key')),
+            os.path.basename(shared.path('computed')) + '.lock',
+        ]))
+
+    def test_api_responses(self):
+        """
+        Test API response computed in one process is served to others.
+        """
+        main.app.config['SHARED_CACHE_DIR'] = self.directory
+        sharedcache.STATS.update(hits=0, misses=0)
+        first = self.client.get('/api/v1/presence_weekday/10').data
+        # simulates another process with empty local cache
         utils.CACHE = {}
+        second = self.client.get('/api/v1/presence_weekday/10').data
+        self.assertEqual(first, second)
+        self.assertEqual(sharedcache.STATS, {'hits': 1, 'misses': 1})
+
+
+class PresenceAnalyzerEventsTestCase(unittest.TestCase):
+    """
+    Server-sent events tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML,
+            'DATA_CACHE': TEST_CACHE_DATA_CSV
+        })
+        self.server = events.EventServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        self.server.stop()
+        if self.thread.ident is None:
+            self.thread.start()
+        self.thread.join()
+        main.app.config['DATA_CSV'] = TEST_DATA_CSV
+
+    def read_stream(self, request, server=None):
+        """
+        Sends raw request to event server, returns what it answered within
+        a short time.
+        """
+        import socket
+        connection = socket.create_connection(
+            (server or self.server).address, 5,
+        )
+        connection.sendall(request)
+        connection.settimeout(0.2)
+        data = ''
+        try:
+            while True:
+                chunk = connection.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        except socket.timeout:
+            pass
+        connection.close()
+        return data
+
+    def test_presence_deltas(self):
+        """
+        Test only changed weekdays and removed users are reported.
+        """
+        old = {10: {0: {'total': 1}, 1: {'total': 2}}, 11: {0: {'total': 3}}}
+        new = {10: {0: {'total': 1}, 1: {'total': 5}}, 12: {0: {'total': 4}}}
+        self.assertEqual(events.presence_deltas(old, new), {
+            10: {1: {'total': 5}},
+            11: None,
+            12: {0: {'total': 4}},
+        })
+        self.assertEqual(events.presence_deltas(new, new), {})
+
+    def test_many_subscribers(self):
+        """
+        Test hundreds of subscribers are served by one thread.
+        """
+        self.thread.start()
+        threads = []
+
+        def publish():
+            threads.append(threading.active_count())
+            self.server.publish({10: {0: {'total': 1}}, 11: None})
+
+        before = threading.active_count()
+        report = loadtest.subscribe(
+            self.server.address, 300, events=2, on_ready=publish,
+        )
+        self.assertEqual(report['streaming'], 300)
+        self.assertEqual(report['completed'], 300)
+        self.assertEqual(threads, [before])
+
+    def test_filter_and_replay(self):
+        """
+        Test subscriber gets missed events of selected users only.
+        """
+        self.thread.start()
+        self.server.publish({10: {0: {'total': 1}}, 11: {0: {'total': 2}}})
+        self.server.publish({11: {0: {'total': 3}}})
+        data = self.read_stream(
+            'GET /api/v1/events?user_id=11 HTTP/1.1\r\n'
+            'Last-Event-ID: 2\r\n\r\n'
+        )
+        self.assertIn('text/event-stream', data)
+        self.assertNotIn('Access-Control-Allow-Origin', data)
+        self.assertEqual(data.count('event: presence'), 1)
+        self.assertIn(
+            'id: 3\nevent: presence\n'
+            'data: {"user_id": 11, "weekdays": {"0": {"total": 3}}}\n\n',
+            data,
+        )
+        self.assertIn(
+            '404 Not Found', self.read_stream('GET /bad HTTP/1.1\r\n\r\n'),
+        )
+        self.assertIn(
+            '400 Bad Request',
+            self.read_stream('GET /api/v1/events?user_id=x HTTP/1.1\r\n\r\n'),
+        )
+
+    def test_allow_origin(self):
+        """
+        Test only configured origin may read the stream in browser.
+        """
+        server = events.EventServer(allow_origin='http://localhost:1246')
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            data = self.read_stream(
+                'GET /api/v1/events HTTP/1.1\r\n\r\n', server,
+            )
+        finally:
+            server.stop()
+            thread.join()
+        self.assertIn(
+            'Access-Control-Allow-Origin: http://localhost:1246\r\n', data,
+        )
+        self.assertNotIn('Access-Control-Allow-Origin: *', data)
+
+    def test_watch(self):
+        """
+        Test deltas are published when new rows are loaded.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'data.csv')
+            shutil.copy(TEST_DATA_CSV, path)
+            main.app.config['DATA_CSV'] = path
+            watcher = threading.Thread(
+                target=events.watch, args=(self.server, 0.01),
+            )
+            watcher.start()
+            time.sleep(0.1)
+            self.assertEqual(self.server.last_id, 0)
+            with open(path, 'a') as data_file:
+                data_file.write('\n12,2013-09-16,09:00:00,17:00:00\n')
+            for _ in range(100):
+                if self.server.last_id:
+                    break
+                time.sleep(0.05)
+            self.server.stop()
+            watcher.join()
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(self.server.last_id, 1)
+        self.assertIn('"user_id": 12', self.server.pending[0][2])
+        self.assertIn('"total": 28800', self.server.pending[0][2])
+
+
+class PresenceAnalyzerMemoryTestCase(unittest.TestCase):
+    """
+    Memory accounting and budget tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.directory = tempfile.mkdtemp()
+        main.app.config.update({
+            'DATA_CSV': os.path.join(self.directory, 'data.csv'),
+            'DATA_XML': TEST_DATA_XML,
+            'DATA_CACHE': TEST_CACHE_DATA_CSV
+        })
+        # synthetic data of 300 users, 60 days each
+        start = datetime.date(2013, 1, 1)
+        storage.write_csv(main.app.config['DATA_CSV'], (
+            (user_id, start + datetime.timedelta(days=day),
+             datetime.time(9, user_id % 60), datetime.time(17, day % 60))
+            for user_id in range(300)
+            for day in range(60)
+        ))
+        self.client = main.app.test_client()
+        utils.CACHE = {}
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.update({'DATA_CSV': TEST_DATA_CSV, 'MEMORY_BUDGET': 0})
+        utils.CACHE = {}
+        shutil.rmtree(self.directory)
+
+    def test_sizeof(self):
+        """
+        Test nested and shared objects are counted once.
+        """
+        item = b'x' * 1000
+        self.assertGreater(memory.sizeof([item]), 1000)
+        self.assertLess(memory.sizeof([item, item]), 2000)
+        self.assertGreater(memory.sizeof({1: {2: [item]}}),
+                           memory.sizeof(item))
+
+    def test_memory_view(self):
+        """
+        Test memory accounting by structure.
+        """
+        self.client.get('/api/v1/presence_weekday/10')
+        resp = self.client.get('/admin/memory')
+        self.assertEqual(resp.status_code, 200)
+        result = json.loads(resp.data)
+        self.assertEqual(result['structures']['user_id']['kind'], 'store')
+        self.assertEqual(result['structures']['presence_weekday'], {
+            'kind': 'users',
+            'entries': 1,
+            'bytes': result['kinds']['users']['bytes'],
+        })
+        self.assertGreater(result['kinds']['store']['bytes'], 1000000)
+        self.assertEqual(result['total'], sum(
+            kind['bytes'] for kind in result['kinds'].values()
+        ))
+        self.assertGreater(result['rss'], 0)
+
+    def test_budget(self):
+        """
+        Test budget holds by evicting responses and per user entries
+        before parsed data.
+        """
+        utils.get_data()
+        store = memory.usage()['total']
+        budget = store + 50000
+        main.app.config['MEMORY_BUDGET'] = budget
+        evicted = dict(memory.EVICTED)
+        for user_id in range(300):
+            for url in ('/api/v1/presence_weekday/{0}',
+                        '/api/v1/chart/presence_weekday/{0}',
+                        '/api/v1/users'):
+                resp = self.client.get(url.format(user_id))
+                self.assertEqual(resp.status_code, 200)
+            self.assertLessEqual(memory.usage()['total'], budget)
+        self.assertIn('user_id', utils.CACHE)
+        self.assertGreater(memory.EVICTED['users'], evicted['users'])
+        self.assertEqual(memory.EVICTED['store'], evicted['store'])
 
 
 def suite():
@@ -366,6 +1660,11 @@ def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(PresenceAnalyzerViewsTestCase))
     suite.addTest(unittest.makeSuite(PresenceAnalyzerUtilsTestCase))
+    suite.addTest(unittest.makeSuite(PresenceAnalyzerStorageTestCase))
+    suite.addTest(unittest.makeSuite(PresenceAnalyzerLoadTestTestCase))
+    suite.addTest(unittest.makeSuite(PresenceAnalyzerSharedCacheTestCase))
+    suite.addTest(unittest.makeSuite(PresenceAnalyzerEventsTestCase))
+    suite.addTest(unittest.makeSuite(PresenceAnalyzerMemoryTestCase))
     return suite
 
 
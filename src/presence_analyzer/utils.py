@@ -2,62 +2,197 @@
 """
 Helper functions used in views.
 """
-import csv
+import bisect
 import logging
-import urllib2
+import math
+import os
 import threading
 import time
 
-from datetime import datetime
-from flask import Response
+from flask import Response, url_for
+from flask.ext.mako import render_template
 from functools import wraps
 from json import dumps
-from lxml import etree
 
 from presence_analyzer.main import app
 
 
 log = logging.getLogger(__name__)  # pylint: disable-msg=C0103
 CACHE = {}
+# seconds between sweeps of expired per arguments entries, time of last one
+CACHE_SWEEP = {'interval': 60, 'time': 0}
+# leading bytes of compressed files
+MAGIC = (
+    ('\x1f\x8b', 'gzip'),
+    ('BZh', 'bz2'),
+    ('\xfd7zXZ\x00', 'xz'),
+)
+STATUS = {'ready': True, 'warm_up_time': None}
+# admission control statistics per resource
+ADMISSION = {}
+ADMISSION_LOCK = threading.Lock()
+
+
+class Overloaded(Exception):
+    """
+    Raised when request would wait for resource longer than allowed.
+    """
+    def __init__(self, resource, retry_after):
+        super(Overloaded, self).__init__(resource, retry_after)
+        self.resource = resource
+        self.retry_after = retry_after
 
 
-def cache(key, duration):
+def cache(key, duration, kind='indexes', version=None):
     """
     Cache function.
     If called item in function, return item.
     If not return item and add to cache.
+    Items of functions called with arguments are cached per arguments.
+    Expired item is returned if function raises Overloaded.
+    Kind of item ('responses', 'users', 'indexes' or 'store') decides
+    order of eviction when MEMORY_BUDGET is exceeded.
+    If version function is given, item is computed again as soon as its
+    result changes, e.g. when data file is modified.
+    Expired items cached per arguments are swept periodically, so caching
+    arbitrary arguments does not grow the cache without bound.
     """
     def _cache(function):
+        @wraps(function)
         def __cache(*args, **kwargs):
-            if key in CACHE:
-                if (time.time() - CACHE[key]['time']) < duration:
-                    return CACHE[key]['value']
+            item_key = key
+            if args or kwargs:
+                item_key = (key, args, tuple(sorted(kwargs.items())))
+            current = version() if version is not None else None
+            item = CACHE.get(item_key)
+            if item is not None and item.get('version') == current:
+                if (time.time() - item['time']) < duration:
+                    item['used'] = time.time()
+                    return item['value']
 
-            result = function(*args, **kwargs)
-            CACHE[key] = {
+            try:
+                result = function(*args, **kwargs)
+            except Overloaded:
+                if item is None:
+                    raise
+                # serve stale item rather than shedding request
+                log.warning('Serving stale %s, resource overloaded', key)
+                return item['value']
+            CACHE[item_key] = {
                 'value': result,
-                'time': time.time()
+                'time': time.time(),
+                'used': time.time(),
+                'kind': kind,
+                'version': current,
+                'duration': duration,
             }
+            if time.time() - CACHE_SWEEP['time'] >= CACHE_SWEEP['interval']:
+                sweep_cache()
+            if app.config.get('MEMORY_BUDGET'):
+                from presence_analyzer.memory import enforce_budget
+                enforce_budget(keep=item_key)
 
-            return CACHE[key]['value']
+            return result
         return __cache
     return _cache
 
 
-def lock(function):
+def sweep_cache():
     """
-    Decorator. If thread is executing the function and another one
-    want to call the function, then second one will immediately
-    receive a return value.
+    Removes expired items of functions cached per arguments. Items under
+    fixed keys are kept, as they may be served when reload is overloaded.
     """
-    function.locker = threading.Lock()
+    CACHE_SWEEP['time'] = now = time.time()
+    for item_key, item in CACHE.items():
+        if isinstance(item_key, tuple) and \
+                now - item['time'] >= item['duration']:
+            CACHE.pop(item_key, None)
 
-    @wraps(function)
-    def locking(*args, **kwargs):
-        with function.locker:
-            result = function(*args, **kwargs)
-        return result
-    return locking
+
+class _Flight(object):
+    """
+    Call of admission controlled function shared by concurrent callers.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def admission(resource):
+    """
+    Decorator. Only one thread executes the function at a time for given
+    arguments, concurrent callers wait for its result instead of calling
+    the function again.
+
+    At most ADMISSION_QUEUE callers wait. Caller is refused with
+    Overloaded if queue is full or remaining time of running call,
+    estimated from previous calls, exceeds ADMISSION_BUDGET seconds.
+    """
+    def _admission(function):
+        stats = ADMISSION.setdefault(resource, {
+            'admitted': 0,
+            'shed': 0,
+            'waiting': 0,
+            'max_waiting': 0,
+            'avg_time': 0.0,
+        })
+        flights = {}
+
+        @wraps(function)
+        def admit(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            budget = app.config.get('ADMISSION_BUDGET', 5.0)
+            with ADMISSION_LOCK:
+                flight = flights.get(key)
+                if flight is None:
+                    flight = flights[key] = _Flight()
+                    leader = True
+                else:
+                    leader = False
+                    remaining = stats['avg_time'] - \
+                        (time.time() - flight.started)
+                    if stats['waiting'] >= app.config.get(
+                            'ADMISSION_QUEUE', 20) or remaining > budget:
+                        stats['shed'] += 1
+                        raise Overloaded(
+                            resource, max(1, int(math.ceil(remaining))),
+                        )
+                    stats['waiting'] += 1
+                    stats['max_waiting'] = max(
+                        stats['max_waiting'], stats['waiting'],
+                    )
+                stats['admitted'] += 1
+
+            if leader:
+                try:
+                    flight.result = function(*args, **kwargs)
+                except Exception as error:
+                    flight.error = error
+                    raise
+                finally:
+                    with ADMISSION_LOCK:
+                        del flights[key]
+                        elapsed = time.time() - flight.started
+                        stats['avg_time'] = elapsed if not stats['avg_time'] \
+                            else 0.8 * stats['avg_time'] + 0.2 * elapsed
+                    flight.done.set()
+                return flight.result
+
+            try:
+                if not flight.done.wait(budget):
+                    with ADMISSION_LOCK:
+                        stats['shed'] += 1
+                    raise Overloaded(resource, max(1, int(math.ceil(budget))))
+            finally:
+                with ADMISSION_LOCK:
+                    stats['waiting'] -= 1
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        return admit
+    return _admission
 
 
 def jsonify(function):
@@ -71,11 +206,58 @@ def jsonify(function):
     return inner
 
 
-@lock
-@cache('user_id', 600)
+def cache_json(key, duration, kind='responses'):
+    """
+    Creates a response with the JSON representation of wrapped function
+    result. Serialized representation is cached per function arguments,
+    also in shared cache of all processes if it is configured.
+    """
+    def _cache_json(function):
+        def compute(*args, **kwargs):
+            from presence_analyzer.sharedcache import shared
+            return shared(
+                key, duration,
+                lambda: dumps(function(*args, **kwargs)),
+                args, kwargs,
+            )
+        serialize = cache(key, duration, kind, sources_version)(compute)
+
+        @wraps(function)
+        def inner(*args, **kwargs):
+            return Response(serialize(*args, **kwargs),
+                            mimetype='application/json')
+        return inner
+    return _cache_json
+
+
+def data_version():
+    """
+    Returns token which changes whenever presence data changes.
+    """
+    from presence_analyzer.storage import get_storage
+    return get_storage().data_version()
+
+
+def xml_version():
+    """
+    Returns token which changes whenever users XML file changes.
+    """
+    from presence_analyzer.storage import file_version
+    return file_version(app.config['DATA_XML'])
+
+
+def sources_version():
+    """
+    Returns token which changes whenever presence data or profiles change.
+    """
+    return data_version(), xml_version()
+
+
+@cache('user_id', 600, 'store', version=data_version)
 def get_data():
     """
-    Extracts presence data from CSV file and groups it by user_id.
+    Extracts presence data from configured storage backend and groups it
+    by user_id. Data is loaded again once it changes.
 
     It creates structure like this:
     data = {
@@ -91,25 +273,139 @@ def get_data():
         }
     }
     """
-    data = {}
-    with open(app.config['DATA_CSV'], 'r') as csvfile:
-        presence_reader = csv.reader(csvfile, delimiter=',')
-        for i, row in enumerate(presence_reader):
-            if len(row) != 4:
-                # ignore header and footer lines
-                continue
+    return _load_data(data_version())
+
+
+@admission('data')
+def _load_data(version):  # pylint: disable-msg=W0613
+    """
+    Loads presence data. Version keeps callers waiting for load of
+    previous data version from sharing its result.
+    """
+    from presence_analyzer.storage import get_storage
+    return get_storage().load()
+
+
+def templates_version():
+    """
+    Returns token which changes whenever any template is modified.
+    Templates are checked in debug mode only, otherwise they are assumed
+    not to change while application is running.
+    """
+    if not app.debug:
+        return None
+    directory = os.path.join(app.root_path, app.template_folder)
+    return max(
+        os.path.getmtime(os.path.join(directory, name))
+        for name in os.listdir(directory)
+    )
 
+
+@cache('page_templates', 86400)
+def page_templates(version):  # pylint: disable-msg=W0613
+    """
+    Returns names of templates which can be rendered as pages.
+    Templates version is part of cache key only.
+    """
+    directory = os.path.join(app.root_path, app.template_folder)
+    return frozenset(
+        name[:-len('.html')]
+        for name in os.listdir(directory)
+        if name.endswith('.html') and name != 'template_base.html'
+    )
+
+
+@cache('page', 86400, 'responses')
+def render_page(template_name, *versions):  # pylint: disable-msg=W0613
+    """
+    Renders page without embedded chart. Templates and assets versions
+    are part of cache key only.
+    """
+    return render_template(template_name + '.html', initial='null')
+
+
+def open_data(path):
+    """
+    Opens data file for reading. Files compressed with gzip, bz2 or xz are
+    detected by magic bytes and decoded while being read.
+    """
+    with open(path, 'rb') as datafile:
+        head = datafile.read(6)
+    compression = next(
+        (name for magic, name in MAGIC if head.startswith(magic)), None,
+    )
+    if compression == 'gzip':
+        import gzip
+        return gzip.open(path, 'rb')
+    if compression == 'bz2':
+        import bz2
+        return bz2.BZ2File(path, 'r')
+    if compression == 'xz':
+        try:
+            import lzma
+        except ImportError:
             try:
-                user_id = int(row[0])
-                date = datetime.strptime(row[1], '%Y-%m-%d').date()
-                start = datetime.strptime(row[2], '%H:%M:%S').time()
-                end = datetime.strptime(row[3], '%H:%M:%S').time()
-            except (ValueError, TypeError):
-                log.debug('Problem with line %d: ', i, exc_info=True)
+                from backports import lzma
+            except ImportError:
+                raise IOError(
+                    'Reading xz file {0} requires backports.lzma'.format(path)
+                )
+        return lzma.open(path, 'rb')
+    return open(path, 'r')
 
-            data.setdefault(user_id, {})[date] = {'start': start, 'end': end}
 
-    return data
+def merge_interval(ranges, start, end):
+    """
+    Inserts (start, end) range into sorted list of disjoint ranges,
+    coalescing it with ranges it overlaps or touches.
+    """
+    i = bisect.bisect_left(ranges, (start, end))
+    if i > 0 and ranges[i - 1][1] >= start:
+        i -= 1
+    j = i
+    while j < len(ranges) and ranges[j][0] <= end:
+        start = min(start, ranges[j][0])
+        end = max(end, ranges[j][1])
+        j += 1
+    ranges[i:j] = [(start, end)]
+    return ranges
+
+
+def add_interval(days, date, start, end):
+    """
+    Adds presence interval to user's days.
+
+    Day entry keeps first arrival as 'start' and last departure as 'end'.
+    If day has more than one disjoint interval, they are kept in
+    'intervals' as sorted list of (start, end) seconds since midnight.
+    Days with single interval, by far the most common, store nothing more.
+    """
+    day = days.get(date)
+    if day is None:
+        days[date] = {'start': start, 'end': end}
+        return
+    ranges = day.get('intervals') or [(
+        seconds_since_midnight(day['start']),
+        seconds_since_midnight(day['end']),
+    )]
+    merge_interval(
+        ranges, seconds_since_midnight(start), seconds_since_midnight(end),
+    )
+    day['start'] = min(day['start'], start)
+    day['end'] = max(day['end'], end)
+    if len(ranges) > 1:
+        day['intervals'] = ranges
+    else:
+        day.pop('intervals', None)
+
+
+def presence_time(day):
+    """
+    Calculates total presence time of day entry in seconds.
+    """
+    if 'intervals' in day:
+        return sum(end - start for start, end in day['intervals'])
+    return interval(day['start'], day['end'])
 
 
 def group_by_weekday(items):
@@ -118,9 +414,7 @@ def group_by_weekday(items):
     """
     result = {i: [] for i in range(7)}
     for date in items:
-        start = items[date]['start']
-        end = items[date]['end']
-        result[date.weekday()].append(interval(start, end))
+        result[date.weekday()].append(presence_time(items[date]))
     return result
 
 
@@ -147,7 +441,8 @@ def mean(items):
 
 def count_avg_group_by_weekday(items):
     """
-    Groups presence starts, ends by weekday.
+    Groups presence starts (first arrivals), ends (last departures) by
+    weekday.
     """
     result = {i: {'start': [], 'end': []} for i in range(7)}
     for date in items:
@@ -163,17 +458,29 @@ def update_user_xml():
     """
     Downloading data from remote adres to xml file.
     """
+    import urllib2
     with open(app.config['DATA_XML'], 'w+') as xmlfile:
         remote_data = urllib2.urlopen('http://sargo.bolt.stxnext.pl/users.xml')
         new_data = remote_data.read()
         xmlfile.write(new_data)
 
 
+@cache('xml_data', 600, 'store', version=xml_version)
 def get_xml_data():
     """
-    Get and parse data from xml file.
+    Get and parse data from xml file. File is parsed again once it changes.
     """
-    with open(app.config['DATA_XML'], 'r') as xmlfile:
+    return _load_xml_data(xml_version())
+
+
+@admission('xml')
+def _load_xml_data(version):  # pylint: disable-msg=W0613
+    """
+    Parses xml file. Version keeps callers waiting for parsing of
+    previous file version from sharing its result.
+    """
+    from lxml import etree
+    with open_data(app.config['DATA_XML']) as xmlfile:
         tree = etree.parse(xmlfile)
         server = tree.find('server')
         host = server.find('host').text
@@ -191,3 +498,59 @@ def get_xml_data():
             for user in users.findall('user')
         }
         return profile
+
+
+def warm_up_paths():
+    """
+    Returns paths of API responses and pages cached by warm-up.
+    """
+    with app.test_request_context():
+        paths = [
+            url_for('users_view'),
+            url_for('users_xml_view'),
+            url_for('users_index_view'),
+        ]
+        paths += [
+            url_for('templates_renderer', template_name=name)
+            for name in sorted(page_templates(templates_version()))
+        ]
+        for user_id in get_data():
+            paths += [
+                url_for(endpoint, user_id=user_id)
+                for endpoint in (
+                    'mean_time_weekday_view',
+                    'presence_weekday_view',
+                    'presence_start_end_view',
+                )
+            ]
+    return paths
+
+
+def warm_up():
+    """
+    Loads presence and XML data, builds per user aggregates and serializes
+    API responses into cache. Application reports readiness when done,
+    also if warm-up failed, requests then load data themselves.
+    """
+    STATUS['ready'] = False
+    started = time.time()
+    try:
+        paths = warm_up_paths()
+        client = app.test_client()
+        for path in paths:
+            try:
+                response = client.get(path)
+            except Exception:  # pylint: disable-msg=W0703
+                log.exception('Warm-up of %s failed', path)
+                continue
+            if response.status_code != 200:
+                log.warning('Warm-up of %s returned %d', path,
+                            response.status_code)
+    except Exception:  # pylint: disable-msg=W0703
+        log.exception('Warm-up failed')
+    else:
+        log.info('Warmed up %d responses in %.2fs', len(paths),
+                 time.time() - started)
+    finally:
+        STATUS['warm_up_time'] = time.time() - started
+        STATUS['ready'] = True
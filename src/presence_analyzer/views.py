@@ -3,21 +3,31 @@
 Defines views.
 """
 import calendar
-import locale
 import logging
+from datetime import datetime
+from json import dumps
 
-from flask import redirect, make_response
+from flask import Response, abort, redirect, make_response, request
 from flask.ext.mako import render_template
-from mako.exceptions import TopLevelLookupException
 
+from presence_analyzer.assets import assets_version
+from presence_analyzer.charts import CHARTS, chart_json
 from presence_analyzer.main import app
+from presence_analyzer.memory import usage
+from presence_analyzer.profiles import users_json
+from presence_analyzer.rankings import METRICS, rank
+from presence_analyzer.sharedcache import STATS as SHARED_CACHE_STATS
+from presence_analyzer.storage import get_storage
 from presence_analyzer.utils import (
-    count_avg_group_by_weekday,
+    ADMISSION,
+    STATUS,
+    Overloaded,
+    cache_json,
     get_data,
     get_xml_data,
-    group_by_weekday,
-    jsonify,
-    mean,
+    page_templates,
+    render_page,
+    templates_version,
 )
 
 log = logging.getLogger(__name__)  # pylint: disable-msg=C0103
@@ -31,8 +41,56 @@ def mainpage():
     return redirect('/presence_weekday')
 
 
+@app.route('/health', methods=['GET'])
+def health_view():
+    """
+    Reports whether worker finished warm-up and is ready for traffic.
+    """
+    return Response(
+        dumps(STATUS),
+        status=200 if STATUS['ready'] else 503,
+        mimetype='application/json',
+    )
+
+
+@app.route('/admin/metrics', methods=['GET'])
+def metrics_view():
+    """
+    Admission control statistics: admitted and shed requests, current and
+    maximal queue depth, average time of expensive call per resource.
+    Hits and misses of shared response cache in this process.
+    """
+    return Response(
+        dumps({'admission': ADMISSION, 'shared_cache': SHARED_CACHE_STATS}),
+        mimetype='application/json',
+    )
+
+
+@app.route('/admin/memory', methods=['GET'])
+def memory_view():
+    """
+    Sizes of cached structures by cache key and kind, memory budget,
+    evicted entries and resident set size of process, in bytes.
+    """
+    return Response(dumps(usage()), mimetype='application/json')
+
+
+@app.errorhandler(Overloaded)
+def overloaded_view(error):
+    """
+    Sheds request which would wait too long for overloaded resource.
+    """
+    response = Response(
+        dumps({'error': 'overloaded', 'resource': error.resource}),
+        status=503,
+        mimetype='application/json',
+    )
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
 @app.route('/api/v1/users', methods=['GET'])
-@jsonify
+@cache_json('users', 600)
 def users_view():
     """
     Users listing for dropdown.
@@ -43,11 +101,12 @@ def users_view():
 
 
 @app.route('/api/v2/users', methods=['GET'])
-@jsonify
+@cache_json('users_xml', 600)
 def users_xml_view():
     """
     Users listing for dropdown.
     """
+    import locale
     data = get_xml_data()
     locale.setlocale(locale.LC_COLLATE, 'pl_PL.UTF-8')
     sorted_data = sorted(
@@ -59,75 +118,162 @@ def users_xml_view():
     return sorted_data
 
 
+@app.route('/api/v3/users', methods=['GET'])
+def users_index_view():
+    """
+    Users known from presence data or profiles, with profile, has_data
+    flag and span of presence data, sorted by name.
+    """
+    return Response(users_json(), mimetype='application/json')
+
+
 @app.route('/api/v1/mean_time_weekday/<int:user_id>', methods=['GET'])
-@jsonify
+@cache_json('mean_time_weekday', 600, 'users')
 def mean_time_weekday_view(user_id):
     """
     Returns mean presence time of given user grouped by weekday.
     """
-    data = get_data()
-    if user_id not in data:
+    storage = get_storage()
+    if not storage.has_user(user_id):
         log.debug('User %s not found!', user_id)
         return []
 
-    weekdays = group_by_weekday(data[user_id])
+    weekdays = storage.weekday_stats(user_id)
 
-    result = [(calendar.day_abbr[weekday], mean(intervals))
-              for weekday, intervals in weekdays.items()]
+    result = [(calendar.day_abbr[weekday], stats['mean'])
+              for weekday, stats in weekdays.items()]
 
     return result
 
 
 @app.route('/api/v1/presence_weekday/<int:user_id>', methods=['GET'])
-@jsonify
+@cache_json('presence_weekday', 600, 'users')
 def presence_weekday_view(user_id):
     """
     Returns total presence time of given user grouped by weekday.
     """
-    data = get_data()
-    if user_id not in data:
+    storage = get_storage()
+    if not storage.has_user(user_id):
         log.debug('User %s not found!', user_id)
         return []
 
-    weekdays = group_by_weekday(data[user_id])
-    result = [(calendar.day_abbr[weekday], sum(intervals))
-              for weekday, intervals in weekdays.items()]
+    weekdays = storage.weekday_stats(user_id)
+    result = [(calendar.day_abbr[weekday], stats['total'])
+              for weekday, stats in weekdays.items()]
 
     result.insert(0, ('Weekday', 'Presence (s)'))
     return result
 
 
 @app.route('/api/v1/presence_start_end/<int:user_id>', methods=['GET'])
-@jsonify
+@cache_json('presence_start_end', 600, 'users')
 def presence_start_end_view(user_id):
     """
     Return avg start, end time of given user grouped by weekday.
     """
-    data = get_data()
+    storage = get_storage()
 
-    if user_id not in data:
+    if not storage.has_user(user_id):
         log.debug('User %s not found!', user_id)
         return []
 
-    weekdays = count_avg_group_by_weekday(data[user_id])
+    weekdays = storage.weekday_stats(user_id)
     result = [
         (
             calendar.day_abbr[weekday],
-            mean(intervals['start']),
-            mean(intervals['end']),
+            stats['start'],
+            stats['end'],
         )
-        for weekday, intervals in weekdays.items()
+        for weekday, stats in weekdays.items()
     ]
     return result
 
 
+@app.route('/api/v1/ranking/<string:metric>', methods=['GET'])
+def ranking_view(metric):
+    """
+    Returns users ranked by mean presence start, end, mean or total
+    presence time. Query string options:
+     - order: 'asc' (default) or 'desc'
+     - limit: number of users, 10 by default
+     - weekday: weekday number (0 is Monday), may be repeated
+     - start, end: date range as YYYY-MM-DD
+    """
+    if metric not in METRICS:
+        abort(404)
+    try:
+        weekdays = sorted(set(
+            int(i) for i in request.args.getlist('weekday')
+        )) or None
+        start, end = [
+            datetime.strptime(request.args[name], '%Y-%m-%d').date()
+            if name in request.args else None
+            for name in ('start', 'end')
+        ]
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        abort(400)
+    if weekdays is not None and not set(weekdays) <= set(range(7)):
+        abort(400)
+    if request.args.get('order', 'asc') not in ('asc', 'desc'):
+        abort(400)
+
+    profiles = get_xml_data()
+    result = [
+        {
+            'user_id': user_id,
+            'name': profiles.get(user_id, {}).get(
+                'name', 'User {0}'.format(user_id),
+            ),
+            'value': value,
+        }
+        for user_id, value in rank(
+            metric,
+            limit=limit,
+            largest=request.args.get('order') == 'desc',
+            weekdays=weekdays,
+            start=start,
+            end=end,
+        )
+    ]
+    return Response(dumps(result), mimetype='application/json')
+
+
+@app.route('/api/v1/chart/<string:template_name>/<int:user_id>',
+           methods=['GET'])
+def chart_view(template_name, user_id):
+    """
+    Returns chart-ready data table of given user for given page.
+    """
+    if template_name not in CHARTS:
+        abort(404)
+    return Response(chart_json(template_name, user_id),
+                    mimetype='application/json')
+
+
 @app.route('/')
 @app.route('/<string:template_name>', methods=['GET'])
 def templates_renderer(template_name):
     """
     Render templates.
+
+    Pages are rendered once and cached, names of existing templates are
+    cached too, so unknown pages are answered without template lookup.
+    If user_id is given in query string, chart table and profile of that
+    user are embedded in the page, so first chart is drawn without
+    additional requests.
     """
-    try:
-        return render_template(template_name + ".html")
-    except TopLevelLookupException:
+    version = templates_version()
+    if template_name not in page_templates(version):
         return make_response("page not found", 404)
+
+    user_id = request.args.get('user_id', type=int)
+    if user_id is None or template_name not in CHARTS:
+        return render_page(template_name, version, assets_version())
+
+    initial = '{{"user_id": {0}, "user": {1}, "table": {2}}}'.format(
+        user_id,
+        dumps(get_xml_data().get(user_id)),
+        chart_json(template_name, user_id),
+    ).replace('</', '<\\/')
+    return render_template(template_name + ".html", initial=initial)